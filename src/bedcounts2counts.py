@@ -8,6 +8,10 @@ for f in TOTAL_?1.bam; do
   bedtools coverage -d -s -abam $f -b mRNA.bed | bedcounts2counts.py > $f.wholereads.tab;
 done;
 date
+
+If all fragments of every transcript come one after another
+(ie. BED sorted by transcript name), use -g to report every transcript
+as soon as its block ends. Otherwise input is sorted in bounded memory.
 """
 epilog="""Author:
 l.p.pryszcz@gmail.com
@@ -15,39 +19,115 @@ l.p.pryszcz@gmail.com
 Dublin, 16/07/2012
 """
 
-import argparse, os, sys
+import argparse, heapq, os, sys, tempfile
 from datetime import datetime
+from bgzf     import open_output
 
-def bedcounts2counts( handle,out,verbose ):
-    """Report coverage at each position of transcript.
+#number of lines sorted in memory (~200 MB)
+CHUNKSIZE = 10**6
+
+def _parse( handle ):
+    """Yield transcript, fragment start, position, strand and count
+    for every line of bedtools coverage -d output.
     """
-    t2counts = {}
-    for line in sys.stdin:
+    for line in handle:
         line = line.strip()
         if not line or line.startswith("#"):
             continue
         #TETp9_9.1_fwd_ref	0	95	TETp9	.	+	1	1951
         chrName,s,e,transcript,score,strand,pos,count = line.split("\t")
-        s,e,pos = int(s),int(e),int(pos)
-        #add new transcript
-        if transcript not in t2counts:
-            t2counts[transcript] = { "strand": strand, "starts": { s: [] } } #[ 0 for i in range(e-s) ]
+        yield transcript,int(s),int(pos),strand,count
+
+def _report( out,transcript,strand,starts ):
+    """Report counts of transcript fragments in transcript orientation."""
+    counts=[]
+    reverse=False
+    if strand=="-":
+        reverse=True
+    for s,region_counts in sorted( starts.iteritems(),reverse=reverse ):
+        counts += region_counts
+    out.write( "%s\t%s\t%s\n" % ( transcript,len(counts),";".join(counts) ) )
+
+def report_grouped( records,out ):
+    """Report transcripts from records grouped by transcript.
+    Every transcript is reported as soon as its block ends,
+    so only one transcript is kept in memory.
+    """
+    i = 0
+    pTranscript = None
+    for transcript,s,pos,strand,count in records:
+        if transcript != pTranscript:
+            if pTranscript is not None:
+                _report( out,pTranscript,pStrand,starts )
+                i += 1
+            pTranscript,pStrand,starts = transcript,strand,{}
         #add new transcript fragment
-        if s not in t2counts[transcript]["starts"]:
-            t2counts[transcript]["starts"][s] = []
+        if s not in starts:
+            starts[s] = []
         #add base count
-        t2counts[transcript]["starts"][s].append( count )
-        
+        starts[s].append( count )
     #add last transcript
-    for transcript in sorted( t2counts.keys() ):
-        counts=[]
-        reverse=False
-        if t2counts[transcript]["strand"]=="-":
-            reverse=True
-        for s,region_counts in sorted( t2counts[transcript]["starts"].iteritems(),reverse=reverse ):
-            #sys.stderr.write( " %s %s %s %s\n" % ( transcript,t2counts[transcript]["strand"],s,region_counts[:10] ) )
-            counts += region_counts
-        out.write( "%s\t%s\t%s\n" % ( transcript,len(counts),";".join(counts) ) )
+    if pTranscript is not None:
+        _report( out,pTranscript,pStrand,starts )
+        i += 1
+    return i
+
+def _dump_chunk( records,tmpdir ):
+    """Save sorted records into temporary file and return its name."""
+    records.sort()
+    fd,fn = tempfile.mkstemp( prefix="bedcounts2counts.",dir=tmpdir )
+    out = os.fdopen( fd,"w" )
+    for r in records:
+        out.write( "%s\t%s\t%s\t%s\t%s\n" % r )
+    out.close()
+    return fn
+
+def _load_chunk( fn ):
+    """Yield records from temporary file."""
+    for line in open( fn ):
+        transcript,s,pos,strand,count = line[:-1].split("\t")
+        yield transcript,int(s),int(pos),strand,count
+
+def external_sort( records,chunksize,tmpdir=None ):
+    """Yield records sorted by transcript, fragment start and position.
+    At most chunksize records are kept in memory; sorted chunks
+    are stored in temporary files and merged.
+    """
+    fnames = []
+    chunk  = []
+    try:
+        for r in records:
+            chunk.append( r )
+            if len( chunk ) >= chunksize:
+                fnames.append( _dump_chunk( chunk,tmpdir ) )
+                chunk = []
+        #everything fits in memory
+        if not fnames:
+            chunk.sort()
+            for r in chunk:
+                yield r
+            return
+        if chunk:
+            fnames.append( _dump_chunk( chunk,tmpdir ) )
+            chunk = []
+        for r in heapq.merge( *[ _load_chunk( fn ) for fn in fnames ] ):
+            yield r
+    finally:
+        for fn in fnames:
+            os.unlink( fn )
+
+def bedcounts2counts( handle,out,verbose,grouped=False,chunksize=CHUNKSIZE,tmpdir=None ):
+    """Report coverage at each position of transcript.
+    If input is grouped by transcript, every transcript is reported
+    as soon as its block ends (input order). Otherwise, input is sorted
+    in bounded memory and transcripts are reported sorted by name.
+    """
+    records = _parse( handle )
+    if not grouped:
+        records = external_sort( records,chunksize,tmpdir )
+    i = report_grouped( records,out )
+    if verbose:
+        sys.stderr.write( "%s transcripts reported.\n" % i )
 
 def main():
     usage  = "bedtools coverage -d -s -abam $f -b mRNA.bed | %(prog)s [options] S1.bam V1.bam S1.+.bed V1.+.bed"
@@ -57,14 +137,28 @@ def main():
     parser.add_argument('--version', action='version', version='1.0')
     parser.add_argument("-i", dest="input",   default=sys.stdin,  type=file,
                         help="input              [stdin]")
-    parser.add_argument("-o", dest="output",  default=sys.stdout, type=argparse.FileType('w'),
-                        help="input              [stdout]")
+    parser.add_argument("-o", dest="output",  default=sys.stdout,
+                        help="output; BGZF with transcript index if ends with .gz [stdout]")
+    parser.add_argument("-g", "--grouped", default=False, action="store_true",
+                        help="input grouped by transcript; report transcripts in input order [%(default)s]")
+    parser.add_argument("-m", "--chunksize", default=CHUNKSIZE, type=int,
+                        help="max lines sorted in memory [%(default)s]")
+    parser.add_argument("-T", "--tmpdir", default=None,
+                        help="directory for temporary files [system default]")
+    parser.add_argument("-t", "--threads", default=1, type=int,
+                        help="number of compression processes [%(default)s]")
    
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
-    bedcounts2counts( o.input,o.output,o.verbose )
+    #open output
+    if type(o.output) is str:
+        o.output = open_output( o.output,o.threads )
+
+    bedcounts2counts( o.input,o.output,o.verbose,o.grouped,o.chunksize,o.tmpdir )
+    if o.output != sys.stdout:
+        o.output.close()
     
 if __name__=='__main__': 
     t0 = datetime.now()
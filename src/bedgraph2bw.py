@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+desc="""Convert bedGraph into compact, indexed binary file (bigWig-like)
+and query it by genomic range.
+
+Intervals are stored in zlib-compressed blocks of up to 1024 records
+(start, end, score), each block covering one chromosome. In addition,
+zoom-level summaries (covered bases, min, max, sum and sum of squares)
+are stored for bins of 10, 100, 1000, 10000 and 100000 bases.
+The block index, together with bedGraph track line, is stored at the
+end of the file, so range queries decompress only overlapping blocks.
+
+USAGE:
+ bedgraph2bw.py -i pars.bedGraph -o pars.pbw
+ bedgraph2bw.py -i pars.pbw -r chrI:1000-2000
+ bedgraph2bw.py -i pars.pbw -r chrI:0-200000 -z 1000
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, gzip, os, struct, sys, zlib
+from datetime import datetime
+import numpy as np
+
+MAGIC     = "PARSBW01"
+BLOCKSIZE = 1024
+ZOOMS     = ( 10,100,1000,10000,100000 )
+#records of intervals and zoom-level summaries
+DTYPE     = np.dtype( [ ("start","<i4"),("end","<i4"),("score","<f4") ] )
+ZOOMDTYPE = np.dtype( [ ("start","<i4"),("end","<i4"),("count","<i4"),("min","<f4"),
+                        ("max","<f4"),("sum","<f8"),("sumsq","<f8") ] )
+
+def summarise( data,binsize ):
+    """Return zoom-level summaries of intervals for bins of given size.
+    Intervals have to be sorted and non-overlapping.
+    """
+    s = data["start"].astype( np.int64 )
+    e = data["end"].astype( np.int64 )
+    v = data["score"].astype( float )
+    #split intervals at bin boundaries
+    first = s//binsize
+    n     = (e-1)//binsize - first + 1
+    idx   = np.repeat( np.arange( len(s) ),n )
+    bins  = first[idx] + np.arange( n.sum() ) - np.repeat( np.cumsum(n)-n,n )
+    ps    = np.maximum( s[idx],bins*binsize )
+    pe    = np.minimum( e[idx],(bins+1)*binsize )
+    w     = pe-ps
+    val   = v[idx]
+    #aggregate pieces by bin
+    ubins,inv = np.unique( bins,return_inverse=True )
+    bstarts   = np.flatnonzero( np.diff( np.concatenate( ([-1],inv) ) ) )
+    zoom = np.zeros( len(ubins),dtype=ZOOMDTYPE )
+    zoom["start"] = np.minimum.reduceat( ps,bstarts )
+    zoom["end"]   = np.maximum.reduceat( pe,bstarts )
+    zoom["count"] = np.bincount( inv,w )
+    zoom["min"]   = np.minimum.reduceat( val,bstarts )
+    zoom["max"]   = np.maximum.reduceat( val,bstarts )
+    zoom["sum"]   = np.bincount( inv,w*val )
+    zoom["sumsq"] = np.bincount( inv,w*val*val )
+    return zoom
+
+class BwWriter(object):
+    """Write sorted intervals into indexed, compressed binary file
+    with zoom-level summaries.
+    """
+    def __init__( self,fn,header="",blocksize=BLOCKSIZE,zooms=ZOOMS ):
+        self.fn        = fn
+        self.out       = open( fn,"wb" )
+        self.header    = header.strip()
+        self.blocksize = blocksize
+        self.zooms     = zooms
+        #level, chrom, start, end, offset, size, count for every block
+        self.index     = []
+        self.chrom     = None
+        self.chroms    = []
+        #start of the last interval
+        self.last      = 0
+        self.pending   = []
+        self.npending  = 0
+        self.out.write( MAGIC )
+
+    def _write_block( self,level,chrom,data ):
+        """Compress and store block of records."""
+        buf = zlib.compress( data.tostring() )
+        self.index.append( ( level,chrom,int(data["start"][0]),int(data["end"].max()),
+                             self.out.tell(),len(buf),len(data) ) )
+        self.out.write( buf )
+
+    def _flush( self,final=False ):
+        """Write full (or all if final) blocks of pending intervals."""
+        if not self.pending:
+            return
+        data = np.concatenate( self.pending )
+        n    = len(data) if final else len(data)//self.blocksize*self.blocksize
+        for i in range( 0,n,self.blocksize ):
+            self._write_block( 0,self.chrom,data[i:i+self.blocksize] )
+        self.pending  = [ data[n:] ] if n < len(data) else []
+        self.npending = len(data)-n
+
+    def add_intervals( self,chroms,starts,ends,scores ):
+        """Add intervals. Chromosomes have to come one after another
+        and intervals within chromosome have to be sorted.
+        Raise ValueError otherwise.
+        """
+        if not len( starts ):
+            return
+        chroms = np.asarray( chroms )
+        #split by chromosome
+        breaks = np.flatnonzero( chroms[1:]!=chroms[:-1] )+1
+        for s,e in zip( np.concatenate( ([0],breaks) ),np.concatenate( (breaks,[len(chroms)]) ) ):
+            chrom = str( chroms[s] )
+            if chrom != self.chrom:
+                if chrom in self.chroms:
+                    raise ValueError( "Unsorted bedGraph: intervals from %s are not consecutive!" % chrom )
+                self._flush( True )
+                self.chrom = chrom
+                self.chroms.append( chrom )
+                self.last  = starts[s]
+            if starts[s] < self.last or np.any( starts[s+1:e] < starts[s:e-1] ):
+                raise ValueError( "Unsorted bedGraph: intervals from %s are not sorted by start!" % chrom )
+            self.last = starts[e-1]
+            data = np.zeros( e-s,dtype=DTYPE )
+            data["start"] = starts[s:e]
+            data["end"]   = ends[s:e]
+            data["score"] = scores[s:e]
+            self.pending.append( data )
+            self.npending += e-s
+            if self.npending >= self.blocksize:
+                self._flush()
+
+    def _write_zooms( self ):
+        """Store zoom-level summaries for every chromosome."""
+        blocks = [ x for x in self.index if x[0]==0 ]
+        f = open( self.fn,"rb" )
+        for chrom in self.chroms:
+            data = np.concatenate( [ _read_block( f,offset,size,DTYPE )
+                                     for level,c,s,e,offset,size,count in blocks if c==chrom ] )
+            for binsize in self.zooms:
+                zoom = summarise( data,binsize )
+                for i in range( 0,len(zoom),self.blocksize ):
+                    self._write_block( binsize,chrom,zoom[i:i+self.blocksize] )
+        f.close()
+
+    def close( self ):
+        """Write remaining intervals, zoom levels and index."""
+        self._flush( True )
+        self.out.flush()
+        self._write_zooms()
+        index  = [ self.header ]
+        index += [ "\t".join( str(x) for x in block ) for block in self.index ]
+        index  = "\n".join( index ) + "\n"
+        ioffset = self.out.tell()
+        self.out.write( index )
+        self.out.write( struct.pack( "<QQ",ioffset,len(index) ) )
+        self.out.write( MAGIC )
+        self.out.close()
+
+def _read_block( f,offset,size,dtype ):
+    """Return records from compressed block."""
+    f.seek( offset )
+    return np.frombuffer( zlib.decompress( f.read(size) ),dtype=dtype )
+
+def is_bw( fn ):
+    """Return True if fn is binary bedGraph."""
+    if not os.path.isfile( fn ):
+        return False
+    with open( fn,"rb" ) as f:
+        return f.read( len(MAGIC) ) == MAGIC
+
+def load_bw_index( fn ):
+    """Return track line and dictionary of blocks for every (level, chrom)."""
+    f = open( fn,"rb" )
+    f.seek( -16-len(MAGIC),2 )
+    ioffset,isize = struct.unpack( "<QQ",f.read(16) )
+    if f.read( len(MAGIC) ) != MAGIC:
+        raise IOError( "Not a binary bedGraph: %s" % fn )
+    f.seek( ioffset )
+    lines  = f.read( isize ).split("\n")
+    f.close()
+    header = lines[0]
+    index  = {}
+    for l in lines[1:]:
+        if not l:
+            continue
+        level,chrom,start,end,offset,size,count = l.split("\t")
+        key = ( int(level),chrom )
+        if key not in index:
+            index[key] = []
+        index[key].append( ( int(start),int(end),int(offset),int(size),int(count) ) )
+    return header,index
+
+def query_bw( fn,chrom,start,end,level=0,index=None ):
+    """Return records overlapping chrom:start-end.
+    Intervals are returned for level 0, zoom summaries otherwise.
+    """
+    if index is None:
+        header,index = load_bw_index( fn )
+    dtype  = DTYPE if not level else ZOOMDTYPE
+    blocks = index.get( ( level,chrom ),[] )
+    f = open( fn,"rb" )
+    data = [ _read_block( f,offset,size,dtype ) for s,e,offset,size,count in blocks
+             if s < end and e > start ]
+    f.close()
+    if not data:
+        return np.zeros( 0,dtype=dtype )
+    data = np.concatenate( data )
+    return data[ (data["start"] < end) & (data["end"] > start) ]
+
+def bedgraph2bw( handle,outfn,verbose ):
+    """Convert bedGraph into binary bedGraph."""
+    header = ""
+    writer = None
+    chroms,starts,ends,scores = [],[],[],[]
+    for l in handle:
+        if l.startswith("track"):
+            header = l
+            continue
+        if not l.strip() or l.startswith("#"):
+            continue
+        chrom,s,e,score = l.split()[:4]
+        chroms.append( chrom )
+        starts.append( int(s) )
+        ends.append( int(e) )
+        scores.append( float(score) )
+        if len( chroms ) < 10**6:
+            continue
+        if not writer:
+            writer = BwWriter( outfn,header )
+        writer.add_intervals( chroms,np.array(starts),np.array(ends),np.array(scores) )
+        chroms,starts,ends,scores = [],[],[],[]
+    if not writer:
+        writer = BwWriter( outfn,header )
+    writer.add_intervals( chroms,np.array(starts),np.array(ends),np.array(scores) )
+    writer.close()
+    if verbose:
+        sys.stderr.write( "%s blocks saved to %s\n" % (len(writer.index),outfn) )
+
+def main():
+
+    usage  = "%(prog)s [options] -i in.bedGraph -o out.pbw"
+    parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog, \
+                                       formatter_class=argparse.RawTextHelpFormatter )
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", "--input",        default=sys.stdin, type=file,
+                        help="input bedGraph or binary bedGraph [stdin]")
+    parser.add_argument("-o", "--out",          default=sys.stdout,
+                        help="output             [stdout]")
+    parser.add_argument("-r", "--region",       default="",
+                        help="report records from region ie. chrI:100-200")
+    parser.add_argument("-z", "--zoom",         default=0, type=int, choices=(0,)+ZOOMS,
+                        help="report zoom-level summaries for bins of given size [%(default)s]")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    #query
+    if o.region:
+        out = o.out
+        if type(out) is str:
+            out = open(out, "w")
+        chrom,coords = o.region.rsplit(":",1)
+        start,end    = [ int(x) for x in coords.split("-") ]
+        header,index = load_bw_index( o.input.name )
+        data = query_bw( o.input.name,chrom,start,end,o.zoom,index )
+        if not o.zoom:
+            out.write( header+"\n" )
+            for r in data:
+                out.write( "%s\t%s\t%s\t%s\n" % (chrom,r["start"],r["end"],float(r["score"])) )
+        else:
+            out.write( "#chrom\tstart\tend\tcount\tmin\tmax\tmean\n" )
+            for r in data:
+                out.write( "%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (chrom,r["start"],r["end"],r["count"],float(r["min"]), \
+                                                              float(r["max"]),r["sum"]/r["count"]) )
+    #or convert
+    else:
+        if o.out == sys.stdout:
+            parser.error("Binary bedGraph has to be saved to file (-o)!")
+        handle = o.input
+        if handle.name.endswith('.gz'):
+            handle = gzip.open(handle.name)
+        bedgraph2bw( handle,o.out,o.verbose )
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
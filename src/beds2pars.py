@@ -12,6 +12,10 @@ for f in *.bam; do
   bedtools genomecov -d -5 -strand $s -g ref.fa.fai -ibam PARS_S1.bam | gzip > PARS_S1.bam.5cov.$s.txt.gz;
  done;
 done
+
+Alternatively, provide only two BAM files (-i S1.bam V1.bam) and
+5'-end coverage of both strands will be computed directly from BAMs
+in a single pass per chromosome, without intermediate files.
 """
 epilog="""Author:
 l.p.pryszcz@gmail.com
@@ -19,20 +23,79 @@ l.p.pryszcz@gmail.com
 Dublin, 21/06/2012
 """
 
-import argparse, commands, gzip, math, os, sys
-from datetime import datetime
+import argparse, gzip, os, sys
+import numpy as np
+import pysam
+from array     import array
+from datetime  import datetime
+from itertools import islice
 from genome_annotation import load_gtf,load_gff,genome2dict,get_gc
+from bedgraph2bw       import BwWriter
+
+#number of algs for already processed BAM files
+ALGSCACHE = os.path.expanduser( "~/.pars_algs_cache" )
+#number of positions processed at once
+CHUNK = 10**6
+LOG2  = np.log(2)
+
+def _load_algs_cache( fn=ALGSCACHE ):
+    """Return dictionary of cached number of algs."""
+    key2algs = {}
+    if not os.path.isfile( fn ):
+        return key2algs
+    for l in open( fn ):
+        ldata = l[:-1].split("\t")
+        if len(ldata) != 5:
+            continue
+        path,size,mtime,mapq,algs = ldata
+        key2algs[ (path,size,mtime,mapq) ] = int( algs )
+    return key2algs
+
+def _get_cache_key( bam,mapq ):
+    """Return key of BAM file: path, size, mtime and mapq."""
+    stat = os.stat( bam )
+    return ( os.path.abspath( bam ),str(stat.st_size),repr(stat.st_mtime),str(mapq) )
 
-def _get_algs_number( bam,mapq=0 ):
-    """Return number of algs in BAM at given mapq."""
-    cmd = "samtools view -q %s -c %s" % (mapq,bam)
-    readno = int( commands.getoutput( cmd ) )
+def _count_algs( bam,mapq,threads ):
+    """Return number of algs in BAM at given mapq.
+    Without mapq filtering, read it from BAM index.
+    """
+    #use index stats (mapped + unmapped as samtools view -c)
+    if not mapq:
+        samfile = pysam.Samfile( bam,"rb" )
+        try:
+            return samfile.mapped + samfile.unmapped
+        except ValueError:
+            pass
+    #or decompress BAM using multiple threads and count
+    samfile = pysam.Samfile( bam,"rb",threads=threads )
+    readno  = 0
+    for sam in samfile.fetch( until_eof=True ):
+        if sam.mapq >= mapq:
+            readno += 1
     return readno
 
-def get_reads_ratio( bam1,bam2 ):
+def _get_algs_number( bam,mapq=0,threads=1,cache=ALGSCACHE ):
+    """Return number of algs in BAM at given mapq.
+    Counts are cached by BAM path, size and mtime.
+    """
+    key = _get_cache_key( bam,mapq )
+    key2algs = _load_algs_cache( cache )
+    if key in key2algs:
+        return key2algs[key]
+    readno = _count_algs( bam,mapq,threads )
+    #store in cache
+    try:
+        with open( cache,"a" ) as out:
+            out.write( "%s\t%s\n" % ( "\t".join(key),readno ) )
+    except IOError:
+        pass
+    return readno
+
+def get_reads_ratio( bam1,bam2,mapq=0,threads=1 ):
     """Return ratio of reads in bam2/bam1"""
-    r2 = _get_algs_number( bam2 )
-    r1 = _get_algs_number( bam1 )
+    r2 = _get_algs_number( bam2,mapq,threads )
+    r1 = _get_algs_number( bam1,mapq,threads )
     return r2*1.0/r1
 
 def open_file( fn ):
@@ -40,10 +103,31 @@ def open_file( fn ):
     if fn.endswith(".gz"):
         return gzip.open(fn)
     else:
-        return      open(bed1)
+        return      open(fn)
+
+def float2str( a ):
+    """Return list of strings for float array, formatted as str() of Python float."""
+    #format every distinct value only once
+    uniq,idx = np.unique( a,return_inverse=True )
+    strs = np.array( [ str(x) for x in uniq.tolist() ],dtype=object )
+    return strs[idx].tolist()
 
-def beds2pars( bed1,bed2,maxPars=10,c2c1ratio=1.0,strand="+",verbose=1 ):
-    """Parse two bed files and report log2(bed1 count/bed2 count). """
+def _read_chunk( handle,size ):
+    """Return chromosomes, positions and counts for up to size lines
+    of genomecov -d output.
+    """
+    lines = list( islice( handle,size ) )
+    data  = "".join( lines ).split()
+    #fall back to line by line split if extra columns
+    if len( data ) != 3*len( lines ):
+        data = [ x for l in lines for x in l.split()[:3] ]
+    chms   = data[0::3]
+    pos    = np.array( data[1::3] ).astype( int )
+    counts = np.array( data[2::3] ).astype( int )
+    return chms,pos,counts
+
+def get_header( maxPars,strand ):
+    """Return bedGraph header line and position shift for given strand."""
     #pars is calculated for one base before read starts
     if   strand=="+":
         posAdd =-1
@@ -51,10 +135,6 @@ def beds2pars( bed1,bed2,maxPars=10,c2c1ratio=1.0,strand="+",verbose=1 ):
     elif strand=="-":
         posAdd = 1
         rgb="0,0,255"
-    #parse bed files
-    if verbose:
-        sys.stderr.write("Parsing BED files...\n" )
-    #write header
     """
     track type=bedGraph name=track_label description=center_label
         visibility=display_mode color=r,g,b altColor=r,g,b
@@ -65,71 +145,254 @@ def beds2pars( bed1,bed2,maxPars=10,c2c1ratio=1.0,strand="+",verbose=1 ):
         windowingFunction=maximum|mean|minimum smoothingWindow=off|2-16
     """
     header='track type=bedGraph name="%s strand" color=%s graphType=bars viewLimits=-%s:%s windowingFunction=maximum\n' % (strand,rgb,maxPars,maxPars)
-    sys.stdout.write( header )
-    #open bed files
+    return header,posAdd
+
+def get_pars( c1,c2,c2c1ratio ):
+    """Return mask of covered positions and pseudo-count log2 ratio
+    log2( (c2+1)/(c1*c2c1ratio+1) ) for them.
+    """
+    covered = ( c1+c2 )!=0
+    pars = np.log( (c2[covered]+1)/(c1[covered]*c2c1ratio+1) )/LOG2
+    return covered,pars
+
+def write_bedgraph( out,chms,starts,ends,pars ):
+    """Write bedGraph lines for intervals in one block."""
+    starts = [ str(x) for x in starts.tolist() ]
+    ends   = [ str(x) for x in ends.tolist() ]
+    lines  = "\n".join( map( "\t".join,zip( chms,starts,ends,float2str( pars ) ) ) )
+    if lines:
+        out.write( lines+"\n" )
+
+def merge_intervals( chms,starts,ends,pars,carry=None ):
+    """Merge adjacent intervals having identical scores.
+    The last interval is returned separately as carry,
+    because it may continue in the next chunk.
+    """
+    if carry:
+        chms   = [ carry[0] ] + chms
+        starts = np.concatenate( ( [carry[1]],starts ) )
+        ends   = np.concatenate( ( [carry[2]],ends ) )
+        pars   = np.concatenate( ( [carry[3]],pars ) )
+    if not len( starts ):
+        return chms,starts,ends,pars,None
+    chmarr = np.array( chms )
+    #new interval if chromosome, position or score changes
+    breaks = np.ones( len(starts),dtype=bool )
+    breaks[1:] = (chmarr[1:]!=chmarr[:-1]) | (starts[1:]!=ends[:-1]) | (pars[1:]!=pars[:-1])
+    first  = np.flatnonzero( breaks )
+    last   = np.concatenate( ( first[1:]-1,[len(starts)-1] ) )
+    chms   = chmarr[first].tolist()
+    starts,ends,pars = starts[first],ends[last],pars[first]
+    carry  = ( chms[-1],starts[-1],ends[-1],pars[-1] )
+    return chms[:-1],starts[:-1],ends[:-1],pars[:-1],carry
+
+def _iter_bed_chunks( bed1,bed2,chunk ):
+    """Yield chromosomes, positions and counts from both genomecov files."""
     h1 = open_file( bed1 )
     h2 = open_file( bed2 )
-    pChm = None
-    #for l1,l2 in zip(h1,h2):
     while True:
-        try:
-            l1,l2        = h1.readline(),h2.readline()
-            if not l1:
-                break
-            chm1,pos1,c1 = l1.split()[:3]
-            chm2,pos2,c2 = l2.split()[:3]        
-            pos1,c1,c2   = int(pos1),int(c1),int(c2)
-            if verbose and pChm != chm1:
-                sys.stderr.write( " %s           \r" % chm1 )
-                pChm = chm1
-            #get pars score
-            pars = math.log( (c2+1)/(c1*c2c1ratio+1),2 )
-            if not c1+c2:
-                continue
-            #save output
-            out = "%s\t%s\t%s\t%s\n" % (chm1,pos1+posAdd,pos1+posAdd+1,pars) #,c2-c1)
-            sys.stdout.write( out )
-        except StopIteration:
+        chms,pos1,c1 = _read_chunk( h1,chunk )
+        chm2,pos2,c2 = _read_chunk( h2,chunk )
+        if not chms:
             break
+        yield chms,pos1,c1,c2[:len(c1)]
 
-def process_files( bam1,bam2,bed1,bed2,maxPars,strand,norm,verbose ):
+def report_pars( chunks,out,c2c1ratio,posAdd,merge=False,quantise=0,verbose=1 ):
+    """Calculate PARS for chunks of chromosomes, positions and counts
+    and report bedGraph intervals to out (file handle or BwWriter).
+    With merge, adjacent bases with identical scores are reported
+    as one interval. With quantise, scores are rounded to multiples of it.
     """
+    pChm  = None
+    carry = None
+    for chms,pos,c1,c2 in chunks:
+        if verbose and pChm != chms[-1]:
+            sys.stderr.write( " %s           \r" % chms[-1] )
+            pChm = chms[-1]
+        #get pars score for covered positions
+        covered,pars = get_pars( c1,c2,c2c1ratio )
+        chms   = [ chm for chm,c in zip( chms,covered ) if c ]
+        starts = pos[covered]+posAdd
+        ends   = starts+1
+        if quantise:
+            pars = np.round( pars/quantise )*quantise + 0.0
+        if merge:
+            chms,starts,ends,pars,carry = merge_intervals( chms,starts,ends,pars,carry )
+        _write_intervals( out,chms,starts,ends,pars )
+    #save last interval
+    if carry:
+        chm,start,end,score = carry
+        _write_intervals( out,[ chm ],np.array([start]),np.array([end]),np.array([score]) )
+
+def _write_intervals( out,chms,starts,ends,pars ):
+    """Save intervals as text bedGraph or binary bedGraph."""
+    if isinstance( out,BwWriter ):
+        out.add_intervals( chms,starts,ends,pars )
+    else:
+        write_bedgraph( out,chms,starts,ends,pars )
+
+def beds2pars( bed1,bed2,maxPars=10,c2c1ratio=1.0,strand="+",verbose=1,chunk=CHUNK,merge=False,quantise=0,bw="" ):
+    """Parse two bed files and report log2(bed1 count/bed2 count).
+    Files are processed in chunks of positions. If bw is provided,
+    intervals are stored there as binary bedGraph (bedgraph2bw.py).
     """
-    #get c2c1ratio
+    #parse bed files
+    if verbose:
+        sys.stderr.write("Parsing BED files...\n" )
+    #write header
+    header,posAdd = get_header( maxPars,strand )
+    if bw:
+        out = BwWriter( bw,header )
+    else:
+        out = sys.stdout
+        out.write( header )
+    chunks = _iter_bed_chunks( bed1,bed2,chunk )
+    report_pars( chunks,out,c2c1ratio,posAdd,merge,quantise,verbose )
+    if bw:
+        out.close()
+
+def get_5end_coverage( samfile,ref,mapq=0 ):
+    """Return positions (1-based) and counts of 5'-ends of reads
+    from given reference for + and - strand, as bedtools genomecov -5.
+    Every read is decoded only once.
+    """
+    reflen  = samfile.lengths[ samfile.references.index( ref ) ]
+    fwd,rev = array('l'),array('l')
+    for sam in samfile.fetch( ref ):
+        if sam.is_unmapped or sam.mapq < mapq:
+            continue
+        if sam.is_reverse:
+            #skip reads ending beyond chromosome
+            if sam.aend <= reflen:
+                rev.append( sam.aend )
+        else:
+            fwd.append( sam.pos+1 )
+    coverage = []
+    for positions in ( fwd,rev ):
+        if positions:
+            coverage.append( np.unique( np.frombuffer( positions,dtype='l' ),return_counts=True ) )
+        else:
+            coverage.append( ( np.zeros( 0,dtype='l' ),np.zeros( 0,dtype=int ) ) )
+    return coverage
+
+def _align_coverage( pos1,c1,pos2,c2 ):
+    """Return common positions and counts for both libraries."""
+    pos = np.union1d( pos1,pos2 )
+    a   = np.zeros( len(pos),dtype=int )
+    b   = np.zeros( len(pos),dtype=int )
+    a[ np.searchsorted( pos,pos1 ) ] = c1
+    b[ np.searchsorted( pos,pos2 ) ] = c2
+    return pos,a,b
+
+def bams2pars( bam1,bam2,strand2out,maxPars=10,c2c1ratio=1.0,mapq=0,verbose=1,merge=False,quantise=0 ):
+    """Calculate 5'-end coverage directly from two BAM files
+    and report log2(bam2 count/bam1 count) for strands in strand2out.
+    Both strands are computed from single pass over every chromosome.
+    """
+    if verbose:
+        sys.stderr.write("Parsing BAM files...\n" )
+    sam1 = pysam.Samfile( bam1,"rb" )
+    sam2 = pysam.Samfile( bam2,"rb" )
+    refs = set( sam2.references )
+    #write headers
+    strand2posAdd = {}
+    for strand,out in strand2out.iteritems():
+        header,strand2posAdd[strand] = get_header( maxPars,strand )
+        if not isinstance( out,BwWriter ):
+            out.write( header )
+    for ref in sam1.references:
+        if ref not in refs:
+            continue
+        cov1 = get_5end_coverage( sam1,ref,mapq )
+        cov2 = get_5end_coverage( sam2,ref,mapq )
+        for i,strand in enumerate( "+-" ):
+            if strand not in strand2out:
+                continue
+            pos,c1,c2 = _align_coverage( cov1[i][0],cov1[i][1],cov2[i][0],cov2[i][1] )
+            if not len( pos ):
+                continue
+            chunks = [ ( [ ref ]*len(pos),pos,c1,c2 ) ]
+            report_pars( chunks,strand2out[strand],c2c1ratio,strand2posAdd[strand],merge,quantise,verbose )
+
+def _get_c2c1ratio( bam1,bam2,norm,verbose,mapq,threads ):
+    """Return ratio of aligned reads if norm, otherwise 1.0."""
     c2c1ratio=1.0        
     if norm:
         if verbose:
             sys.stderr.write("Calculating ratio of aligned reads...\n" )
-        c2c1ratio = get_reads_ratio( bam1,bam2 )
+        c2c1ratio = get_reads_ratio( bam1,bam2,mapq,threads )
         if verbose:
             sys.stderr.write(" Ratio of alignments (%s:%s): %s\n" % (bam2,bam1,c2c1ratio) )
+    return c2c1ratio
+
+def process_bams( bam1,bam2,maxPars,strand,norm,verbose,mapq=0,threads=1,merge=False,quantise=0,bw="",outbase="" ):
+    """Report PARS computed directly from BAM files.
+    With outbase, both strands are saved to outbase.+.bedGraph
+    and outbase.-.bedGraph.
+    """
+    c2c1ratio = _get_c2c1ratio( bam1,bam2,norm,verbose,mapq,threads )
+    if outbase:
+        strand2out = { s: open( "%s.%s.bedGraph" % (outbase,s),"w" ) for s in "+-" }
+    elif bw:
+        strand2out = { strand: BwWriter( bw,get_header( maxPars,strand )[0] ) }
+    else:
+        strand2out = { strand: sys.stdout }
+    bams2pars( bam1,bam2,strand2out,maxPars,c2c1ratio,mapq,verbose,merge,quantise )
+    for out in strand2out.itervalues():
+        if out != sys.stdout:
+            out.close()
+
+def process_files( bam1,bam2,bed1,bed2,maxPars,strand,norm,verbose,mapq=0,threads=1,merge=False,quantise=0,bw="" ):
+    """
+    """
+    #get c2c1ratio
+    c2c1ratio = _get_c2c1ratio( bam1,bam2,norm,verbose,mapq,threads )
         
     #check if correct number of files
-    beds2pars( bed1,bed2,maxPars,c2c1ratio,strand,verbose )
+    beds2pars( bed1,bed2,maxPars,c2c1ratio,strand,verbose,merge=merge,quantise=quantise,bw=bw )
     
 def main():
 
-    usage  = "%(prog)s [options] S1.bam V1.bam S1.+.bed V1.+.bed"
+    usage  = "%(prog)s [options] -i S1.bam V1.bam [S1.+.bed V1.+.bed]"
     parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog )
     
     parser.add_argument("-v", dest="verbose", default=False, action="store_true", help="verbose")    
     parser.add_argument('--version', action='version', version='1.0')
-    parser.add_argument("-i", dest="files",   nargs=4, type=file,
-                        help="input files        [%(default)s]")
+    parser.add_argument("-i", dest="files",   nargs="+", type=file,
+                        help="two BAM files (and two genomecov files) [%(default)s]")
     parser.add_argument("-m", dest="maxPars", default=7.0, type=float,
                         help="max. PARS score    [%(default)s]")
     parser.add_argument("-n", dest="norm",    default=False, action="store_true",
                         help="normalise read counts between samples [%(default)s]" )
     parser.add_argument("-s", dest="strand",  default="+", choices=("+","-"),
                         help="strand             [%(default)s]" )
+    parser.add_argument("-q", dest="mapq",    default=0, type=int,
+                        help="min mapping quality of reads counted [%(default)s]" )
+    parser.add_argument("-t", dest="threads", default=1, type=int,
+                        help="decompression threads used for counting reads [%(default)s]" )
+    parser.add_argument("--merge",    default=False, action="store_true",
+                        help="merge adjacent bases with identical scores [%(default)s]" )
+    parser.add_argument("--quantise", default=0, type=float,
+                        help="round scores to multiples of it [%(default)s]" )
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("-b", dest="bw",      default="",
+                        help="save as binary bedGraph (bedgraph2bw.py) instead of stdout" )
+    output.add_argument("-o", dest="outbase", default="",
+                        help="save both strands to OUTBASE.+.bedGraph and OUTBASE.-.bedGraph (BAM input only)" )
  
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
     #get fnames
+    if len( o.files ) not in ( 2,4 ):
+        parser.error( "Provide two BAM files and optionally two genomecov files!" )
+    if len( o.files ) == 2:
+        bam1,bam2 = [ f.name for f in o.files ]
+        process_bams( bam1,bam2,o.maxPars,o.strand,o.norm,o.verbose,o.mapq,o.threads,o.merge,o.quantise,o.bw,o.outbase )
+        return
     bam1,bam2,bed1,bed2 = [ f.name for f in o.files ]        
-    process_files( bam1,bam2,bed1,bed2,o.maxPars,o.strand,o.norm,o.verbose )    
+    process_files( bam1,bam2,bed1,bed2,o.maxPars,o.strand,o.norm,o.verbose,o.mapq,o.threads,o.merge,o.quantise,o.bw )    
     
 if __name__=='__main__': 
     t0 = datetime.now()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+desc="""Write and read block-gzipped (BGZF) .tab/.counts/PARS files.
+
+BGZF is a series of gzip members, each storing up to 64 KB of text,
+so it's readable by gzip, zcat and pigz as any other .gz file.
+Blocks are compressed by pool of processes, so compression
+is no longer serial tail of the pipeline.
+
+In addition, transcript index is stored alongside the file (file.gz.idx,
+same layout as in tabindex.py), with virtual offsets (compressed offset
+of the block << 16 | offset within uncompressed block) instead of
+plain offsets, so record of any transcript can be read by decompressing
+only the block(s) storing it.
+
+USAGE:
+ bgzf.py -i S1.counts -o S1.counts.gz -t 4
+ bgzf.py -d -i S1.counts.gz > S1.counts
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, os, struct, sys, zlib
+from datetime import datetime
+from multiprocessing import Pool
+
+#max uncompressed size of the block (as in samtools/htslib)
+BLOCKSIZE = 65280
+#number of blocks compressed at once by every process
+NBLOCKS   = 64
+#gzip header with BC extra field; block size-1 follows
+HEADER    = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+#empty block marking end of file
+EOF       = HEADER + "\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+def _compress_block( args ):
+    """Return BGZF block for given data.
+    Executed by worker processes.
+    """
+    data,level = args
+    c = zlib.compressobj( level,zlib.DEFLATED,-15 )
+    cdata = c.compress( data ) + c.flush()
+    bsize = len(HEADER) + 2 + len(cdata) + 8
+    return HEADER + struct.pack( "<H",bsize-1 ) + cdata + \
+           struct.pack( "<II",zlib.crc32( data ) & 0xffffffff,len(data) )
+
+class BgzfWriter(object):
+    """Write text into BGZF file using pool of processes.
+    Pool can be shared by several writers; it's closed only if created here.
+    Unless index=False, byte offsets of every line
+    are stored in file.idx upon closing.
+    """
+    def __init__( self,fn,threads=1,level=6,index=True,pool=None ):
+        self.name     = fn
+        self.out      = open( fn,"wb" )
+        self.level    = level
+        self.ownpool  = pool is None and threads>1
+        self.pool     = Pool( threads ) if self.ownpool else pool
+        self.maxsize  = NBLOCKS * max( threads,1 ) * BLOCKSIZE
+        self.buffer   = []
+        self.size     = 0
+        self.pending  = None
+        #compressed offset of every block
+        self.coffsets = []
+        #name, uncompressed offset and size of every line
+        self.index    = [] if index else None
+        self.partial  = ""
+        self.offset   = 0
+
+    def _index_lines( self,data ):
+        """Store name, offset and size of every complete line."""
+        lines = ( self.partial + data ).split("\n")
+        self.partial = lines.pop()
+        for l in lines:
+            name = l.split('\t',1)[0]
+            if name != l:
+                self.index.append( ( name,self.offset,len(l)+1 ) )
+            self.offset += len(l)+1
+
+    def write( self,data ):
+        """Write text."""
+        if self.index is not None:
+            self._index_lines( data )
+        self.buffer.append( data )
+        self.size += len(data)
+        if self.size >= self.maxsize:
+            self._flush()
+
+    def _write_blocks( self,blocks ):
+        """Write compressed blocks."""
+        for block in blocks:
+            self.coffsets.append( self.out.tell() )
+            self.out.write( block )
+
+    def _flush( self,final=False ):
+        """Compress full (or all if final) blocks of pending text.
+        Blocks are compressed in the background, while
+        previously compressed blocks are written.
+        """
+        data = "".join( self.buffer )
+        n    = len(data) if final else len(data)//BLOCKSIZE*BLOCKSIZE
+        args = [ ( data[i:i+BLOCKSIZE],self.level ) for i in range( 0,n,BLOCKSIZE ) ]
+        self.buffer = [ data[n:] ] if n < len(data) else []
+        self.size   = len(data)-n
+        if not self.pool:
+            self._write_blocks( map( _compress_block,args ) )
+            return
+        if self.pending:
+            self._write_blocks( self.pending.get() )
+        self.pending = self.pool.map_async( _compress_block,args )
+
+    def _save_index( self ):
+        """Store virtual offsets of lines in file.idx."""
+        #last line without new line character
+        name = self.partial.split('\t',1)[0]
+        if name != self.partial:
+            self.index.append( ( name,self.offset,len(self.partial) ) )
+        tmp = "%s.idx.%s" % ( self.name,os.getpid() )
+        stat = os.stat( self.name )
+        with open( tmp,"w" ) as out:
+            out.write( "#%s\t%s\n" % ( stat.st_size,repr(stat.st_mtime) ) )
+            for name,offset,size in self.index:
+                i = offset // BLOCKSIZE
+                out.write( "%s\t%s\t%s\n" % ( name,self.coffsets[i]<<16 | offset-i*BLOCKSIZE,size ) )
+        os.rename( tmp,self.name+".idx" )
+
+    def close( self ):
+        """Write remaining blocks, EOF marker and index."""
+        self._flush( True )
+        if self.pool:
+            self._write_blocks( self.pending.get() )
+        if self.ownpool:
+            self.pool.close()
+            self.pool.join()
+        self.out.write( EOF )
+        self.out.close()
+        if self.index is not None:
+            self._save_index()
+
+def open_output( fn,threads=1,pool=None ):
+    """Return BGZF writer if fn ends with .gz, plain file otherwise.
+    If pool, blocks are compressed by this (shared) pool of threads processes.
+    """
+    if fn.endswith(".gz"):
+        return BgzfWriter( fn,threads,pool=pool )
+    return open( fn,"w" )
+
+def is_bgzf( fn ):
+    """Return True if fn is BGZF file."""
+    if not os.path.isfile( fn ):
+        return False
+    with open( fn,"rb" ) as f:
+        return f.read( len(HEADER) ) == HEADER
+
+class BgzfReader(object):
+    """Read BGZF file. Offsets (tell and seek) are virtual offsets."""
+    def __init__( self,fn ):
+        self.name    = fn
+        self.handle  = open( fn,"rb" )
+        self.coffset = self.noffset = self.within = 0
+        self.buffer  = ""
+        self._load_block( 0 )
+
+    def _load_block( self,coffset ):
+        """Decompress block starting at coffset. Return False at the end of file."""
+        if self.handle.tell() != coffset:
+            self.handle.seek( coffset )
+        header = self.handle.read( len(HEADER)+2 )
+        self.coffset,self.within = coffset,0
+        if not header:
+            self.buffer,self.noffset = "",coffset
+            return False
+        if header[:len(HEADER)] != HEADER:
+            raise IOError( "Not a BGZF block at %s in %s" % (coffset,self.name) )
+        bsize, = struct.unpack( "<H",header[-2:] )
+        cdata  = self.handle.read( bsize+1-len(header) )
+        self.buffer  = zlib.decompress( cdata[:-8],-15 )
+        self.noffset = coffset + bsize+1
+        return True
+
+    def _next_block( self ):
+        """Move to next block. Return False at the end of file."""
+        return self._load_block( self.noffset )
+
+    def tell( self ):
+        """Return virtual offset of current position."""
+        if self.within >= len( self.buffer ):
+            return self.noffset << 16
+        return self.coffset << 16 | self.within
+
+    def seek( self,offset ):
+        """Move to virtual offset."""
+        coffset = offset >> 16
+        if coffset != self.coffset:
+            self._load_block( coffset )
+        self.within = offset & 0xffff
+
+    def read( self,size=-1 ):
+        """Return up to size bytes (everything if size<0)."""
+        chunks = []
+        while size:
+            if self.within >= len( self.buffer ):
+                if not self._next_block():
+                    break
+                continue
+            data = self.buffer[self.within:] if size<0 else self.buffer[self.within:self.within+size]
+            self.within += len(data)
+            if size>0:
+                size -= len(data)
+            chunks.append( data )
+        return "".join( chunks )
+
+    def readline( self ):
+        """Return next line."""
+        chunks = []
+        while True:
+            if self.within >= len( self.buffer ):
+                if not self._next_block():
+                    break
+                continue
+            i = self.buffer.find( "\n",self.within )
+            if i < 0:
+                chunks.append( self.buffer[self.within:] )
+                self.within = len( self.buffer )
+                continue
+            chunks.append( self.buffer[self.within:i+1] )
+            self.within = i+1
+            break
+        return "".join( chunks )
+
+    def __iter__( self ):
+        return iter( self.readline,"" )
+
+    def close( self ):
+        self.handle.close()
+
+def main():
+
+    usage  = "%(prog)s [options] -i file.counts -o file.counts.gz"
+    parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog, \
+                                       formatter_class=argparse.RawTextHelpFormatter )
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", "--input",        default=sys.stdin, type=file,
+                        help="input stream       [stdin]")
+    parser.add_argument("-o", "--out",          default=sys.stdout,
+                        help="output             [stdout]")
+    parser.add_argument("-d", "--decompress",   default=False, action="store_true",
+                        help="decompress BGZF file")
+    parser.add_argument("-t", "--threads",      default=1, type=int,
+                        help="number of compression processes [%(default)s]")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    #decompress
+    if o.decompress:
+        out = o.out
+        if type(out) is str:
+            out = open(out, "w")
+        handle = BgzfReader( o.input.name )
+        for data in iter( lambda: handle.read( BLOCKSIZE ),"" ):
+            out.write( data )
+    #or compress
+    else:
+        if o.out == sys.stdout:
+            parser.error("BGZF has to be saved to file (-o)!")
+        out = BgzfWriter( o.out,o.threads )
+        for l in o.input:
+            out.write( l )
+        out.close()
+        if o.verbose:
+            sys.stderr.write( "%s blocks with %s records saved to %s\n" % (len(out.coffsets),len(out.index),o.out) )
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
@@ -7,109 +7,235 @@ l.p.pryszcz@gmail.com
 Dublin, 2/07/2012
 """
 
-import argparse, gzip, os, sys
-from datetime import datetime
-from math     import log
+import argparse, os, sys
+from collections     import deque
+from cStringIO       import StringIO
+from datetime        import datetime
+from multiprocessing import Pool
+import numpy   as np
+from tabreader import iter_tab
+from bgzf     import open_output
+
+#number of positions scored at once
+BATCH = 10**6
+LOG2  = np.log(2)
+
+def iter_pars( fn ):
+    """Yield transcript name and counts for every transcript."""
+    return iter_tab( fn,dtype=float )
+
+def get_tot_count( fn ):
+    """Return totCount from given experiment in millions."""
+    totCount = 0
+    for name,c in iter_pars( fn ):
+        totCount += c.sum()
+    return totCount/10.0e6
 
 def load_pars( fn,getTotCount=0 ):
     """Return dictionary of counts for every transcript.
     In addition, return totCount from given experiment in millions.
+    Binary counts store (tab2bin.py) is memory-mapped.
     """
     name2counts = {}
-    #open file
-    if fn.endswith(".gz"):
-        handle = gzip.open(fn)
-    else:
-        handle =     open(fn)
     #load scores/counts
     totCount = 0
-    for l in handle:
-        l = l.strip()
-        l = l.strip(";")
-        name,length,counts = l.split("\t")[:3]
-        c = [ float(x) for x in counts.split(";") ]
+    for name,c in iter_pars( fn ):
         name2counts[name] = c
-        totCount += sum(c)
+        totCount += c.sum()
     if getTotCount:
         return ( name2counts,totCount/10.0e6 )
     return name2counts
 
-def _get_load( s1,v1 ):
-    """Return True if s1 and v1 pass load threshold.
+def _iter_sorted( fn ):
+    """Yield transcript name and counts for every transcript.
+    Raise ValueError if transcripts are not sorted by name.
+    """
+    pname = None
+    for name,c in iter_pars( fn ):
+        if pname is not None and name < pname:
+            raise ValueError( "Transcripts not sorted by name in %s: %s after %s!" % (fn,name,pname) )
+        pname = name
+        yield name,c
+
+def merge_pars( *fnames ):
+    """Yield transcript name and counts from every file,
+    walking all files in lock-step. Transcripts missing
+    in any of the files are skipped.
+
+    Files have to be sorted by transcript name.
+    """
+    iterators = [ _iter_sorted( fn ) for fn in fnames ]
+    records   = [ next( it,None ) for it in iterators ]
+    while None not in records:
+        names = [ name for name,c in records ]
+        last  = max( names )
+        #yield if the same transcript in all files
+        if names.count( last ) == len( names ):
+            yield last,[ c for name,c in records ]
+            records = [ next( it,None ) for it in iterators ]
+            continue
+        #otherwise move forward all files behind
+        for i,name in enumerate( names ):
+            if name < last:
+                records[i] = next( iterators[i],None )
+
+def _concatenate( name2counts,genes ):
+    """Return counts of genes concatenated into one float array
+    and offsets of every gene (plus the end of the last one).
     """
-    #if not sum(s1) or not sum(v1):
-    #    return False
-    eff_length = len(s1)
-    s1load = sum(s1)/eff_length
-    v1load = sum(v1)/eff_length    
-    #if s1load>=loadTh and v1load>=loadTh:
-    #    return True
-    return s1load,v1load
+    lengths = [ len(name2counts[gene]) for gene in genes ]
+    offsets = np.concatenate( ([0],np.cumsum( lengths,dtype=int )) )
+    if not genes:
+        return np.zeros(0),offsets
+    data = np.concatenate( [ np.asarray( name2counts[gene],dtype=float ) for gene in genes ] )
+    return data,offsets
 
 def normalise_counts( s1name2counts,v1name2counts,c0name2counts,s1Count,v1Count,c0Count,verbose ):
     """Normalise by reads from control library.
+    All transcripts are normalised at once.
     """
+    genes = list( s1name2counts )
+    s1,offsets = _concatenate( s1name2counts,genes )
+    v1,offsets = _concatenate( v1name2counts,genes )
+    c0,offsets = _concatenate( c0name2counts,genes )
+    #normalize by total number of reads and by control
+    s1n = s1 - c0*s1Count/c0Count
+    v1n = v1 - c0*v1Count/c0Count
+    #zero counts < 0
+    s1n[ s1n<0 ] = 0
+    v1n[ v1n<0 ] = 0
+    #store views of normalised arrays
     s1n2c = {}
     v1n2c = {}
-    for gene in s1name2counts:
-        #get counts for gene
-        s1 = s1name2counts[gene]
-        v1 = v1name2counts[gene]
-        c0 = c0name2counts[gene]
-        
-        #normalise each position count by control
-        s1n = []
-        v1n = []
-        for si,vi,ci in zip( s1,v1,c0 ):
-            #normalize by total number of reads and by control
-            cn = ci/c0Count
-            #sn = ( si/s1Count - cn ) * s1Count
-            sn = si - ci*s1Count/c0Count
-            vn = vi - ci*v1Count/c0Count
-            #zero counts < 0 and append to lists
-            if sn < 0:
-                sn = 0
-            s1n.append( sn )    
-            if vn < 0:
-                vn = 0
-            v1n.append( vn )
-
-        #store
-        s1n2c[gene] = s1n
-        v1n2c[gene] = v1n
-
+    for gene,s,e in zip( genes,offsets[:-1],offsets[1:] ):
+        s1n2c[gene] = s1n[s:e]
+        v1n2c[gene] = v1n[s:e]
     return ( s1n2c,v1n2c )
-            
-def process_gene( output,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,minReads,readsPerSample,verbose ):
+
+def get_pars( s1,v1,minReads,readsPerSample ):
+    """Return list of PARS scores, log2(v1/s1) formatted with 2 decimals,
+    for s1 and v1 arrays. Positions failing read thresholds get "0".
     """
+    ok = (s1!=0) & (v1!=0) & (s1>=readsPerSample) & (v1>=readsPerSample) & (s1+v1>=minReads)
+    pars = np.log( v1[ok]/s1[ok] )/LOG2
+    #"%.2f" rounds exact ties (x.xx5) to even, round() away from zero
+    ties = np.mod( pars*8,2 )==1
+    pars[ties] += np.sign( pars[ties] )*1e-9
+    #format every distinct score only once
+    uniq,idx = np.unique( pars,return_inverse=True )
+    scores = np.array( [ "%.2f" % x for x in uniq.tolist() ],dtype=object )
+    out = np.empty( len(s1),dtype=object )
+    out[:]  = "0"
+    out[ok] = scores[idx]
+    return out.tolist()
+
+def _process_batch( output,genes,s1name2counts,v1name2counts,loadTh,minReads,readsPerSample ):
+    """Score batch of transcripts at once. Return number of transcripts passing load filter."""
+    s1,offsets = _concatenate( s1name2counts,genes )
+    v1,offsets = _concatenate( v1name2counts,genes )
+    lengths = np.diff( offsets )
+    #check if both samples passes load criteria
+    s1loads = np.add.reduceat( s1,offsets[:-1] )/lengths
+    v1loads = np.add.reduceat( v1,offsets[:-1] )/lengths
+    passed  = (s1loads>=loadTh) & (v1loads>=loadTh)
+    #calculate pars score for each base of passing transcripts
+    mask = np.repeat( passed,lengths )
+    pars = get_pars( s1[mask],v1[mask],minReads,readsPerSample )
+    #write output
+    s = 0
+    for gene,length,s1load,v1load in zip( np.array(genes)[passed],lengths[passed],s1loads[passed],v1loads[passed] ):
+        line = "%s\t%s\t%s\t%s\t%s\n" % ( gene,length,";".join( pars[s:s+length] ),float(s1load),float(v1load) )
+        output.write( line )
+        s += length
+    return passed.sum()
+
+def _process_chunk( output,genes,s1name2counts,v1name2counts,c0name2counts,s1Count,v1Count,c0Count,loadTh,minReads,readsPerSample ):
+    """Normalise (if control provided) and score chunk of transcripts.
+    Return number of transcripts passing load filter.
     """
-    i=k=0
-    for gene in s1name2counts:
-        s1 = s1name2counts[gene]
-        v1 = v1name2counts[gene]
+    if c0name2counts:
+        s1name2counts,v1name2counts = normalise_counts( s1name2counts,v1name2counts,c0name2counts,s1Count,v1Count,c0Count,0 )
+    return _process_batch( output,genes,s1name2counts,v1name2counts,loadTh,minReads,readsPerSample )
+
+def _score_chunk( args ):
+    """Return PARS output and number of transcripts passing load filter
+    for chunk of transcripts. Executed by worker processes.
+    """
+    out = StringIO()
+    k   = _process_chunk( out,*args )
+    return out.getvalue(),k
+
+def _iter_chunks( records,batch ):
+    """Yield number of processed transcripts and chunk of ~batch positions
+    as (genes, s1name2counts, v1name2counts, c0name2counts).
+    """
+    i = 0
+    genes = []
+    s1name2counts,v1name2counts,c0name2counts = {},{},{}
+    size = 0
+    for gene,counts in records:
         i += 1
-        if verbose:
-            sys.stderr.write(" %s %s %s    \r" % (i,k,gene) )        
-        #check if both samples passes load criteria
-        s1load,v1load = _get_load( s1,v1 )
-        if s1load < loadTh or v1load < loadTh:
+        #skip empty transcripts
+        if not len( counts[0] ):
             continue
-        k+=1
-        #calculate pars score for each base
-        pars = []
-        for si,vi in zip( s1,v1 ):
-            if si and vi and si>=readsPerSample and vi>=readsPerSample and si+vi>=minReads:
-                #p = "%.2f" % round( log( vi*s1Count / si*v1Count,2 ),2 )
-                p = "%.2f" % round( log( vi / si,2 ),2 )
-            else:
-                p = "0"
-            pars.append( p )
-        #write output
-        line = "%s\t%s\t%s\t%s\t%s\n" % ( gene,len(pars),";".join( pars ),s1load,v1load )
-        output.write( line )
+        genes.append( gene )
+        s1name2counts[gene] = counts[0]
+        v1name2counts[gene] = counts[1]
+        if len( counts )>2:
+            c0name2counts[gene] = counts[2]
+        size += len( counts[0] )
+        if size < batch:
+            continue
+        yield i,( genes,s1name2counts,v1name2counts,c0name2counts )
+        genes = []
+        s1name2counts,v1name2counts,c0name2counts = {},{},{}
+        size = 0
+    yield i,( genes,s1name2counts,v1name2counts,c0name2counts )
+
+def score_chunks( output,records,s1Count,v1Count,c0Count,loadTh,minReads,readsPerSample,verbose,batch=BATCH,threads=1 ):
+    """Calculate and write PARS scores for transcripts passing load filter.
+    Records of (gene, [s1, v1, (c0)]) are scored in chunks of ~batch positions.
+    With threads>1 chunks are scored by pool of processes, but output
+    is written in order of records, so it's identical to single process run.
+    Return number of processed and passed transcripts.
+    """
+    i=k=0
+    pending = deque()
+    if threads>1:
+        pool = Pool( threads )
+    for i,( genes,s1name2counts,v1name2counts,c0name2counts ) in _iter_chunks( records,batch ):
+        if not genes:
+            continue
+        args = ( genes,s1name2counts,v1name2counts,c0name2counts,s1Count,v1Count,c0Count,loadTh,minReads,readsPerSample )
+        if threads>1:
+            pending.append( pool.apply_async( _score_chunk,(args,) ) )
+            #keep limited number of chunks in memory
+            while len( pending )>2*threads:
+                text,passed = pending.popleft().get()
+                output.write( text )
+                k += passed
+        else:
+            k += _process_chunk( output,*args )
+        if verbose:
+            sys.stderr.write(" %s %s %s    \r" % (i,k,genes[-1]) )
+    #write remaining chunks
+    while pending:
+        text,passed = pending.popleft().get()
+        output.write( text )
+        k += passed
+    if threads>1:
+        pool.close()
+        pool.join()
     return ( i,k )
+
+def process_gene( output,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,minReads,readsPerSample,verbose,batch=BATCH,threads=1 ):
+    """Calculate and write PARS scores for transcripts passing load filter.
+    Transcripts are scored in chunks of ~batch positions.
+    """
+    records = ( ( gene,( s1name2counts[gene],v1name2counts[gene] ) ) for gene in s1name2counts )
+    return score_chunks( output,records,s1Count,v1Count,0,loadTh,minReads,readsPerSample,verbose,batch,threads )
     
-def counts2pars( s1fn,v1fn,ctrl,loadTh,output,minReads,readsPerSample,verbose ):
+def counts2pars( s1fn,v1fn,ctrl,loadTh,output,minReads,readsPerSample,verbose,threads=1 ):
     """Calculate log2(v1/s1) for every base from s1/v1.
     Skip transcripts having load below loadTh in any of the samples.
     """
@@ -129,11 +255,36 @@ def counts2pars( s1fn,v1fn,ctrl,loadTh,output,minReads,readsPerSample,verbose ):
     #then process transcripts
     if verbose:
         sys.stderr.write("Calculating PARS scores...\n")
-    i,k = process_gene( output,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,minReads,readsPerSample,verbose )
+    i,k = process_gene( output,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,minReads,readsPerSample,verbose,threads=threads )
     
     if verbose:
         sys.stderr.write("Processed %s transcripts. %s passed load filter.\n" % (i,k) )        
         
+def counts2pars_stream( s1fn,v1fn,ctrl,loadTh,output,minReads,readsPerSample,verbose,batch=BATCH,threads=1 ):
+    """Calculate log2(v1/s1) for every base from s1/v1 in two passes.
+    First pass collects library totals, second walks all files
+    in lock-step and reports scores for chunks of transcripts,
+    so memory is bounded by batch size (or the longest transcript).
+    """
+    #first get library totals
+    if verbose:
+        sys.stderr.write("Counting reads...\n")
+    s1Count = get_tot_count( s1fn )
+    v1Count = get_tot_count( v1fn )
+    c0Count = 0
+    fnames  = [ s1fn,v1fn ]
+    if ctrl:
+        c0Count = get_tot_count( ctrl.name )
+        fnames.append( ctrl.name )
+
+    #then process transcripts
+    if verbose:
+        sys.stderr.write("Calculating PARS scores...\n")
+    i,k = score_chunks( output,merge_pars( *fnames ),s1Count,v1Count,c0Count,loadTh,minReads,readsPerSample,verbose,batch,threads )
+    
+    if verbose:
+        sys.stderr.write("Processed %s transcripts. %s passed load filter.\n" % (i,k) )        
+
 def main():
 
     usage  = "%(prog)s [options] [options] -i S1.counts V1.counts"
@@ -143,8 +294,8 @@ def main():
     parser.add_argument('--version', action='version', version='1.0')
     parser.add_argument("-i", dest="files",   nargs=2, type=file,
                         help="input files        [%(default)s]")
-    parser.add_argument("-o", dest="output",  default=sys.stdout, type=argparse.FileType('w'),
-                        help="input              [stdout]")
+    parser.add_argument("-o", dest="output",  default=sys.stdout,
+                        help="output; BGZF with transcript index if ends with .gz [stdout]")
     parser.add_argument("-l", dest="load",    default=1.0, type=float,
                         help="minimum load       [%(default)s]")
     parser.add_argument("-c", dest="ctrl",    type=file,
@@ -153,14 +304,27 @@ def main():
                         help="min s reads at position in all samples [%(default)s]")
     parser.add_argument("-s", dest="readsPerSample", default=0, type=int,
                         help="min s reads at position in each sample [%(default)s]")
+    parser.add_argument("--stream", default=False, action="store_true",
+                        help="two-pass streaming with bounded memory; input files have to be sorted by transcript name")
+    parser.add_argument("--threads", default=1, type=int,
+                        help="number of processes to use [%(default)s]")
   
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
+    #open output
+    if type(o.output) is str:
+        o.output = open_output( o.output,o.threads )
+
     #process two tabs files
     fn1,fn2 = [ f.name for f in o.files ]
-    counts2pars( fn1,fn2,o.ctrl,o.load,o.output,o.minReads,o.readsPerSample,o.verbose )
+    if o.stream:
+        counts2pars_stream( fn1,fn2,o.ctrl,o.load,o.output,o.minReads,o.readsPerSample,o.verbose,threads=o.threads )
+    else:
+        counts2pars( fn1,fn2,o.ctrl,o.load,o.output,o.minReads,o.readsPerSample,o.verbose,o.threads )
+    if o.output != sys.stdout:
+        o.output.close()
 
 if __name__=='__main__': 
   t0=datetime.now()
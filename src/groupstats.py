@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+desc="""Correlation statistics computed for many groups (ie. genes) at once.
+
+Values of all groups are concatenated into one array
+and group of every value is given by group id (0..ngroups-1).
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import numpy as np
+from scipy.stats import distributions
+
+def group_ranks( values,gids ):
+    """Return average ranks of values within groups.
+    Ranks are offset by start of the group, what doesn't affect correlation.
+    """
+    order = np.lexsort( (values,gids) )
+    v,g   = values[order],gids[order]
+    #runs of tied values within group
+    new   = np.ones( len(v),dtype=bool )
+    new[1:] = ( v[1:]!=v[:-1] ) | ( g[1:]!=g[:-1] )
+    starts  = np.flatnonzero( new )
+    ends    = np.append( starts[1:],len(v) )
+    ranks   = np.empty( len(v) )
+    ranks[order] = ( (starts+ends+1)/2.0 )[ np.cumsum(new)-1 ]
+    return ranks
+
+def group_pearson( x,y,gids,ngroups ):
+    """Return Pearson r, P-value, slope and intercept of linear fit
+    for every group.
+    """
+    n  = np.bincount( gids,minlength=ngroups ).astype( float )
+    with np.errstate( divide='ignore',invalid='ignore' ):
+        mx = np.bincount( gids,x,ngroups ) / n
+        my = np.bincount( gids,y,ngroups ) / n
+        dx,dy = x-mx[gids],y-my[gids]
+        sxx = np.bincount( gids,dx*dx,ngroups )
+        syy = np.bincount( gids,dy*dy,ngroups )
+        sxy = np.bincount( gids,dx*dy,ngroups )
+        r   = np.clip( sxy/np.sqrt( sxx*syy ),-1,1 )
+        slope     = sxy/sxx
+        intercept = my-slope*mx
+        #P-value from t distribution as in pearsonr
+        dof  = n-2
+        t    = r*np.sqrt( dof/((1.0-r)*(1.0+r)) )
+        pval = 2*distributions.t.sf( np.abs(t),dof )
+    pval[ np.abs(r)==1 ] = 0
+    #two points always lie on the line, as in recent pearsonr
+    pval[ n<=2 ] = 1
+    return r,pval,slope,intercept
@@ -11,7 +11,7 @@ import argparse, gzip, os, sys
 from math     import log
 import numpy  as np
 from datetime import datetime
-from counts2pars import load_pars, _check_load, normalise_counts
+from counts2pars import load_pars, _concatenate, normalise_counts
 
 def load_pearson( handle ):
     """Return dictionary with pearson coefficients
@@ -24,31 +24,44 @@ def load_pearson( handle ):
         gene2pearson[gene] = ( coeff,stdev )
     return gene2pearson
 
-def process_gene( output,gene2pearson,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,verbose ):
-    """
-    """
-    i=k=0
-    coeffs = [] #,stdevs = [],[]
-    for gene in s1name2counts:
-        s1 = s1name2counts[gene]
-        v1 = v1name2counts[gene]
-        i += 1
-        #check if both samples passes load criteria
-        if not _check_load( s1,v1,loadTh ):
-            continue
-        k+=1
-        if gene not in gene2pearson:
-            if verbose:
-                sys.stderr.write( " Warning: %s not found in gene2pearson!\n" % gene )
-            continue
-        #add coeff and stdev
-        coeff,stdev = gene2pearson[gene]
-        coeffs.append( coeff )
-        #stdevs.append( stdev )
+def get_loads( name2counts,genes ):
+    """Return load (cuts per bp) of every gene."""
+    counts,offsets = _concatenate( name2counts,genes )
+    if not len( genes ):
+        return np.zeros(0)
+    return np.add.reduceat( counts,offsets[:-1] ) / np.diff( offsets )
+
+def process_gene( output,gene2pearson,s1name2counts,v1name2counts,s1Count,v1Count,loadThs,verbose ):
+    """Report number of genes passing every load threshold in both samples
+    and mean and stdev of their pearson coefficients.
 
+    Loads are computed only once. Genes are sorted by load at which they stop
+    passing, so genes passing any threshold form prefix of that order,
+    and mean and stdev come from cumulative sums of coefficients.
+    """
+    genes = [ g for g in s1name2counts if g in v1name2counts ]
+    #gene passes threshold if both samples pass it
+    minload = np.minimum( get_loads( s1name2counts,genes ),get_loads( v1name2counts,genes ) )
+    order   = np.argsort( -minload,kind='mergesort' )
+    #coefficients of genes in that order
+    found   = np.array( [ genes[i] in gene2pearson for i in order ],dtype=bool )
+    coeffs  = np.array( [ gene2pearson[genes[i]][0] if f else 0 for i,f in zip( order,found ) ],dtype=float )
+    if verbose:
+        for i,f in zip( order,found ):
+            if not f:
+                sys.stderr.write( " Warning: %s not found in gene2pearson!\n" % genes[i] )
+    n   = np.concatenate( ( [0],np.cumsum( found ) ) )
+    s   = np.concatenate( ( [0],np.cumsum( coeffs ) ) )
+    ss  = np.concatenate( ( [0],np.cumsum( coeffs**2 ) ) )
+    #number of genes passing every threshold
+    k   = np.searchsorted( -minload[order],-np.asarray( loadThs,dtype=float ),side='right' )
+    with np.errstate( divide='ignore',invalid='ignore' ):
+        mean  = s[k] / n[k]
+        stdev = np.sqrt( np.maximum( ss[k]/n[k] - mean**2,0 ) )
     #write output
-    line = "%s\t%s\t%s\t%s\n" % ( loadTh,k,np.mean(coeffs),np.std(coeffs) )
-    output.write( line )
+    for loadTh,ki,m,sd in zip( loadThs,k,mean,stdev ):
+        line = "%s\t%s\t%s\t%s\n" % ( loadTh,ki,m,sd )
+        output.write( line )
     
 def counts2pearson( s1fn,v1fn,pearson,ctrl,loadThs,output,verbose ):
     """Calculate log2(v1/s1) for every base from s1/v1.
@@ -57,8 +70,7 @@ def counts2pearson( s1fn,v1fn,pearson,ctrl,loadThs,output,verbose ):
     #first load counts
     if verbose:
         sys.stderr.write("Loading pearson coefficients...\n")
-    gene2pearson = load_pearson( pearson ); print len(gene2pearson),gene2pearson.keys()[:10]
-    #return
+    gene2pearson = load_pearson( pearson )
 
     #then load counts
     if verbose:
@@ -77,8 +89,7 @@ def counts2pearson( s1fn,v1fn,pearson,ctrl,loadThs,output,verbose ):
     if verbose:
         sys.stderr.write("Selecting passing gene... \n" )
     output.write( "#laod\tgenes\tmean\tstdev\n" )
-    for loadTh in loadThs:
-        process_gene( output,gene2pearson,s1name2counts,v1name2counts,s1Count,v1Count,loadTh,verbose )
+    process_gene( output,gene2pearson,s1name2counts,v1name2counts,s1Count,v1Count,loadThs,verbose )
         
 def main():
 
@@ -95,6 +106,8 @@ def main():
                         help="output             [stdout]")
     parser.add_argument("-l", dest="loads",    nargs="+", default=[1.0], type=float,
                         help="load thresholds    [%(default)s]")
+    parser.add_argument("-r", dest="range",   nargs=3, default=[], type=float,
+                        help="load thresholds from MIN to MAX by STEP instead of -l")
     parser.add_argument("-c", dest="ctrl",    type=file,
                         help="normalize with control counts [%(default)s]")
   
@@ -102,6 +115,10 @@ def main():
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
+    #dense grid of thresholds
+    if o.range:
+        o.loads = np.arange( *o.range ).tolist()
+
     #process two tabs files
     fn1,fn2 = [ f.name for f in o.files ]
     counts2pearson( fn1,fn2,o.pearson,o.ctrl,o.loads,o.output,o.verbose )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+desc="""Manage on-disk cache of correlation statistics.
+
+Caching is off unless requested (--cache in tab2correlation.py,
+tab2roc.py and tabs2plot.py). Results (dictionaries of numpy arrays)
+are stored as .npz files named by key, that is SHA1 of function name
+and version, content hashes of input files and parameters. Version
+has to be increased whenever cached function changes its results.
+Content hashes are computed once and remembered by file path, size
+and mtime. Once cache grows above max size, least recently used
+results are removed.
+
+USAGE:
+ parscache.py          # report cache content
+ parscache.py --clear  # remove all cached results
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, hashlib, os, sys
+from datetime import datetime
+import numpy as np
+
+CACHEDIR  = os.path.expanduser( "~/.pars_cache" )
+CACHESIZE = 256 * 2**20
+BLOCKSIZE = 2**20
+
+def _load_hashes( fn ):
+    """Return dictionary of cached content hashes."""
+    key2hash = {}
+    if not os.path.isfile( fn ):
+        return key2hash
+    for l in open( fn ):
+        ldata = l[:-1].split("\t")
+        if len(ldata) != 4:
+            continue
+        path,size,mtime,sha1 = ldata
+        key2hash[ (path,size,mtime) ] = sha1
+    return key2hash
+
+def file_hash( fn,cachedir=CACHEDIR ):
+    """Return SHA1 of file content.
+    Hashes are cached by file path, size and mtime.
+    """
+    stat = os.stat( fn )
+    key  = ( os.path.abspath( fn ),str(stat.st_size),repr(stat.st_mtime) )
+    hashesfn = os.path.join( cachedir,"hashes.txt" )
+    key2hash = _load_hashes( hashesfn )
+    if key in key2hash:
+        return key2hash[key]
+    sha1 = hashlib.sha1()
+    with open( fn,"rb" ) as f:
+        for block in iter( lambda: f.read( BLOCKSIZE ),"" ):
+            sha1.update( block )
+    #store in cache
+    try:
+        if not os.path.isdir( cachedir ):
+            os.makedirs( cachedir )
+        with open( hashesfn,"a" ) as out:
+            out.write( "%s\t%s\n" % ( "\t".join(key),sha1.hexdigest() ) )
+    except (IOError,OSError):
+        pass
+    return sha1.hexdigest()
+
+def get_key( name,version,fnames,params,cachedir=CACHEDIR ):
+    """Return cache key for results of given version of name
+    computed from fnames with params.
+    """
+    sha1 = hashlib.sha1( "%s\t%s" % (name,version) )
+    for fn in fnames:
+        sha1.update( file_hash( fn,cachedir ) )
+    sha1.update( repr( params ) )
+    return sha1.hexdigest()
+
+def load_results( key,cachedir=CACHEDIR ):
+    """Return cached results as dictionary of arrays or None."""
+    fn = os.path.join( cachedir,key+".npz" )
+    if not os.path.isfile( fn ):
+        return None
+    try:
+        npz  = np.load( fn )
+        data = { k: npz[k] for k in npz.files }
+        npz.close()
+    except (IOError,ValueError):
+        return None
+    #mark as recently used
+    os.utime( fn,None )
+    return data
+
+def save_results( key,data,cachedir=CACHEDIR,maxsize=CACHESIZE ):
+    """Store dictionary of arrays in cache and evict old results."""
+    fn  = os.path.join( cachedir,key+".npz" )
+    tmp = "%s.%s.tmp" % ( fn,os.getpid() )
+    try:
+        if not os.path.isdir( cachedir ):
+            os.makedirs( cachedir )
+        with open( tmp,"wb" ) as out:
+            np.savez( out,**data )
+        os.rename( tmp,fn )
+    except (IOError,OSError):
+        return
+    evict( cachedir,maxsize )
+
+def _get_entries( cachedir ):
+    """Return list of (mtime, size, path) for cached results."""
+    entries = []
+    if not os.path.isdir( cachedir ):
+        return entries
+    for fn in os.listdir( cachedir ):
+        if not fn.endswith(".npz"):
+            continue
+        path = os.path.join( cachedir,fn )
+        stat = os.stat( path )
+        entries.append( ( stat.st_mtime,stat.st_size,path ) )
+    return entries
+
+def evict( cachedir=CACHEDIR,maxsize=CACHESIZE ):
+    """Remove least recently used results until cache is below maxsize.
+    Return number of removed results.
+    """
+    entries = sorted( _get_entries( cachedir ),reverse=True )
+    total   = sum( size for mtime,size,path in entries )
+    removed = 0
+    while total > maxsize and entries:
+        mtime,size,path = entries.pop()
+        try:
+            os.unlink( path )
+        except OSError:
+            continue
+        total   -= size
+        removed += 1
+    return removed
+
+def main():
+
+    usage  = "%(prog)s [options]"
+    parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog, \
+                                       formatter_class=argparse.RawTextHelpFormatter )
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-d", "--cachedir",     default=CACHEDIR,
+                        help="cache directory    [%(default)s]")
+    parser.add_argument("-m", "--maxsize",      default=CACHESIZE, type=int,
+                        help="evict results above this size in bytes [%(default)s]")
+    parser.add_argument("--clear",              default=False, action="store_true",
+                        help="remove all cached results")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    if o.clear:
+        o.maxsize = -1
+    removed = evict( o.cachedir,o.maxsize )
+    entries = _get_entries( o.cachedir )
+    sys.stdout.write( "%s results removed; %s results of %s bytes in %s\n" % \
+                      ( removed,len(entries),sum( e[1] for e in entries ),o.cachedir ) )
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+desc="""Convert .tab/.counts files into binary counts store and back.
+
+Binary store keeps counts of all transcripts as one concatenated
+numeric array, preceded by transcript index (name, offset, length).
+The array is memory-mapped on loading, so opening even transcriptome-wide
+library is almost instant and costs no more RAM than the raw array.
+
+Layout:
+- magic (8 bytes)
+- header size (uint64, little-endian)
+- header: dtype in 1st line, then name<TAB>offset<TAB>length for every transcript
+- padding to 8 bytes
+- counts array
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, gzip, os, struct, sys
+from datetime import datetime
+import numpy as np
+
+MAGIC = "PARSBIN1"
+
+def is_bin( fn ):
+    """Return True if fn is binary counts store."""
+    if not os.path.isfile(fn):
+        return False
+    with open(fn, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load_index( fn ):
+    """Return dtype, list of (name, offset, length) and data offset."""
+    f = open(fn, "rb")
+    if f.read(len(MAGIC)) != MAGIC:
+        raise IOError("Not a binary counts store: %s" % fn)
+    hsize, = struct.unpack("<Q", f.read(8))
+    header = f.read(hsize).split("\n")
+    f.close()
+    dtype = np.dtype(header[0])
+    index = []
+    for l in header[1:]:
+        if not l:
+            continue
+        name, offset, length = l.split("\t")
+        index.append((name, int(offset), int(length)))
+    #data starts at 8 bytes aligned position
+    doffset = len(MAGIC) + 8 + hsize
+    doffset += -doffset % 8
+    return dtype, index, doffset
+
+def load_bin( fn ):
+    """Return index and memory-mapped counts array."""
+    dtype, index, doffset = load_index(fn)
+    size = sum(length for name, offset, length in index)
+    if not size:
+        return index, np.zeros(0, dtype=dtype)
+    data = np.memmap(fn, dtype=dtype, mode="r", offset=doffset, shape=(size,))
+    return index, data
+
+def iter_bin( fn ):
+    """Yield name and counts (memory-mapped view) for every transcript."""
+    index, data = load_bin(fn)
+    for name, offset, length in index:
+        yield name, data[offset:offset+length]
+
+def _iter_tab( handle ):
+    """Yield name and list of string counts for every line of .tab/.counts."""
+    for l in handle:
+        ldata = l.split("\t")
+        if len(ldata) < 2:
+            continue
+        name = ldata[0]
+        #.counts has length in 2nd column
+        counts = ldata[2] if len(ldata) > 2 else ldata[1]
+        yield name, counts.strip().strip(";").split(";")
+
+def tab2bin( handle, outfn, verbose ):
+    """Save .tab/.counts as binary counts store."""
+    names, lengths, chunks = [], [], []
+    isint = True
+    for name, counts in _iter_tab(handle):
+        c = np.array(counts, dtype=float)
+        if isint and not np.all(np.mod(c, 1)==0):
+            isint = False
+        names.append(name)
+        lengths.append(len(c))
+        chunks.append(c)
+        if verbose and not len(names) % 1000:
+            sys.stderr.write(" %s %s    \r" % (len(names), name))
+    #store integers if only integer counts
+    dtype = np.dtype("<i4") if isint else np.dtype("<f8")
+    #prepare header
+    offsets = np.cumsum([0] + lengths[:-1])
+    header  = [dtype.str]
+    header += ["%s\t%s\t%s" % x for x in zip(names, offsets, lengths)]
+    header  = "\n".join(header) + "\n"
+    out = open(outfn, "wb")
+    out.write(MAGIC)
+    out.write(struct.pack("<Q", len(header)))
+    out.write(header)
+    out.write("\0" * (-out.tell() % 8))
+    for c in chunks:
+        out.write(c.astype(dtype).tostring())
+    out.close()
+    if verbose:
+        sys.stderr.write("%s transcripts with %s positions saved to %s\n" % (len(names), sum(lengths), outfn))
+
+def _format( c ):
+    """Return list of strings for counts array."""
+    return [str(x) for x in c.tolist()]
+
+def bin2tab( fn, out, counts, verbose ):
+    """Report binary counts store as .tab (or .counts) text."""
+    i = 0
+    for name, c in iter_bin(fn):
+        i += 1
+        if counts:
+            out.write("%s\t%s\t%s\n" % (name, len(c), ";".join(_format(c))))
+        else:
+            out.write("%s\t%s\n" % (name, ";".join(_format(c))))
+    if verbose:
+        sys.stderr.write("%s transcripts reported.\n" % i)
+
+def main():
+
+    usage  = "%(prog)s [options] -i file.tab -o file.bin"
+    parser  = argparse.ArgumentParser(usage=usage, description=desc, epilog=epilog, \
+                                      formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", "--input",        default=sys.stdin, type=file,
+                        help="input stream       [stdin]")
+    parser.add_argument("-o", "--out",          default=sys.stdout,
+                        help="output             [stdout]")
+    parser.add_argument("-r", "--reverse",      default=False, action="store_true",
+                        help="convert binary store back to text")
+    parser.add_argument("--counts",             default=False, action="store_true",
+                        help="report .counts (name, length, counts) instead of .tab")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    if o.reverse:
+        out = o.out
+        if type(out) is str:
+            out = open(out, "w")
+        bin2tab(o.input.name, out, o.counts, o.verbose)
+    else:
+        if o.out == sys.stdout:
+            parser.error("Binary store has to be saved to file (-o)!")
+        handle = o.input
+        if handle.name.endswith('.gz'):
+            handle = gzip.open(handle.name)
+        tab2bin(handle, o.out, o.verbose)
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
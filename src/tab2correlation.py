@@ -7,108 +7,350 @@ l.p.pryszcz@gmail.com
 Mizerow, 20/02/2012
 """
 
-import argparse, gzip, os, sys
+import argparse, os, sys
 from datetime import datetime
 
 import numpy             as np
+from multiprocessing import Pool
 from scipy.stats import stats
+from tabreader   import iter_tab
+from parscache   import CACHEDIR, get_key, load_results, save_results
+
+#version of cached results; increase whenever they change
+CACHEVERSION = 1
 
 def load_tab(handle, load, minCount, controls):
     """Return tab-separated file as dict"""
-    #deal with fname instead of fileobj
-    if type(handle) is str:
-        handle = open(handle)
-    #open as gzip if needed
-    if handle.name.endswith('.gz'):
-        handle = gzip.open(handle.name)
+    #deal with fileobj instead of fname
+    if type(handle) is not str:
+        handle = handle.name
     #load
     data = {}
-    for l in handle:
-        ldata = l.split('\t')
-        if len(ldata) != 2:
-            info = "Warning: 2 fields expected, but %s found! %s\n"
-            sys.stderr.write(info % (len(ldata), str(ldata)))
-            continue
-        #filter controls
-        geneid = ldata[0]
-        if controls and geneid not in controls:
-            continue
-        #unload tab file
-        cdata = [int(x) for x in ldata[1].strip().strip(';').split(';')]
-        #skip if too small load
-        if load and 1.0 * sum(cdata) / len(cdata) < load:
-            continue
-        #skip if too few cut points
-        if minCount and len(filter(lambda x: x!=0, cdata)) < minCount:
-            continue
-        #store
+    for geneid, cdata in iter_tab(handle, controls, load, minCount, int, 2):
         data[geneid] = cdata
     return data
 
-def concatenate_scores(cgenes, gene2scores1, gene2scores2, ignore_zeros):
-    """Concatenate scores from common genes"""
-    scores1, scores2 = [], []
-    for gene in cgenes:
-        for c1, c2 in zip(gene2scores1[gene], gene2scores2[gene]):
-            if ignore_zeros and not c1 and not c2:
-                continue
-            scores1.append(c1)
-            scores2.append(c2)
-    return scores1, scores2
+def _load_arrays(args):
+    """Return transcript names, lengths and concatenated counts from tab file.
+    Executed by worker process.
+    """
+    fn, load, minCount, controls = args
+    data    = load_tab(fn, load, minCount, controls)
+    names   = sorted(data)
+    lengths = np.array([len(data[n]) for n in names], dtype=int)
+    if not names:
+        return names, lengths, np.zeros(0, dtype=int)
+    return names, lengths, np.concatenate([np.asarray(data[n]) for n in names])
+
+def load_tabs(fnames, load, minCount, controls, threads=1, verbose=0):
+    """Load tab files in parallel and align them onto shared transcript index.
+    Return transcript names, transcript offsets (n+1), files x positions
+    matrix of counts and files x transcripts presence mask.
+    Transcripts of different length than in the first file having them
+    are skipped (with warning).
+    """
+    args = [(fn, load, minCount, controls) for fn in fnames]
+    if threads > 1:
+        p = Pool(threads)
+        results = p.map(_load_arrays, args)
+        p.close()
+        p.join()
+    else:
+        results = map(_load_arrays, args)
+    #shared index - transcript length taken from first file having it
+    name2length = {}
+    for tnames, tlengths, values in results:
+        for name, length in zip(tnames, tlengths):
+            if name not in name2length:
+                name2length[name] = length
+    names   = np.array(sorted(name2length))
+    lengths = np.array([name2length[n] for n in names], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+    #store integers if only integer counts
+    dtype = np.int32
+    if any(values.dtype.kind == 'f' for tnames, tlengths, values in results):
+        dtype = float
+    matrix  = np.zeros((len(fnames), offsets[-1]), dtype=dtype)
+    present = np.zeros((len(fnames), len(names)), dtype=bool)
+    for i, fn in enumerate(fnames):
+        tnames, tlengths, values = results[i]
+        results[i] = None
+        if not tnames:
+            continue
+        idx = np.searchsorted(names, tnames)
+        #skip transcripts of different length than in index
+        ok  = lengths[idx] == tlengths
+        if not ok.all():
+            info = "Warning: %s transcripts of different length than in previous files skipped in %s!\n"
+            sys.stderr.write(info % (np.count_nonzero(~ok), fn))
+        present[i, idx[ok]] = True
+        #copy counts into their positions in shared index
+        starts = np.cumsum(tlengths) - tlengths
+        dest   = np.repeat(offsets[idx] - starts, tlengths) + np.arange(len(values))
+        mask   = np.repeat(ok, tlengths)
+        matrix[i, dest[mask]] = values[mask]
+        if verbose:
+            sys.stderr.write(" %s: %s transcripts\n" % (fn, np.count_nonzero(ok)))
+    return names, offsets, matrix, present
     
-def tabs2correlation(files, out, load, minCount, controlsFn, ignore_zeros, verbose):
-    """Load tab files and report correlation between them"""
-    #load controls
-    controls = []
-    if controlsFn:
-       controls = set(l.strip() for l in open(controlsFn))
-       if verbose:
-           sys.stderr.write(" %s control names loaded.\n" % len(controls))
-           
-    #load tab files
-    if verbose:
-        sys.stderr.write("Loading %s tab files...\n" % len(files))
-    tabdata = { f.name: load_tab(f, load, minCount, controls) for f in files }
+def rank_matrix(matrix):
+    """Return centered average ranks of every row of matrix."""
+    ranks = np.empty(matrix.shape)
+    for i in range(len(matrix)):
+        ranks[i] = stats.rankdata(matrix[i])
+    return ranks - (matrix.shape[1] + 1) / 2.0
 
-    #define array to store scores
-    scores  = np.zeros((len(files), len(files)))
-    pvalues = np.zeros((len(files), len(files)))
-    #calcute correlation
-    if verbose:
-        sys.stderr.write("Calculating Spearman correlation...\n")        
-    for i in range(len(files)):
+def spearman_matrix(matrix, ignore_zeros=False, blocksize=10**6):
+    """Return Spearman rho, P-value and number of compared positions
+    for all pairs of rows of files x positions matrix.
+
+    Every row is ranked only once. If ignore_zeros, positions with zero in both rows
+    are excluded from every pair. Ranks of remaining positions are then obtained
+    analytically, as removing m shared zeros shifts ranks of zeros by m/2
+    and ranks of all (non-negative) values above by m, so with R ranks,
+    Z zero indicators and m = Z.Z' the adjusted ranks of pair (i, j) are R + (m/2)*Z.
+    """
+    nfiles, npos = matrix.shape
+    R = rank_matrix(matrix)
+    if not ignore_zeros:
+        n = np.zeros((nfiles, nfiles)) + npos
+        C = np.dot(R, R.T)
+        S = np.zeros((nfiles, nfiles))
+        Q = np.diag(C)[:, None] + S
+    else:
+        #products of ranks and zero indicators computed by blocks of positions
+        RR, RZ, m = [np.zeros((nfiles, nfiles)) for i in range(3)]
+        for i in range(0, npos, blocksize):
+            r = R[:, i:i+blocksize]
+            z = (matrix[:, i:i+blocksize] == 0).astype(float)
+            RR += np.dot(r, r.T)
+            RZ += np.dot(r, z.T)
+            m  += np.dot(z, z.T)
+        z  = np.diag(m)
+        sR = R.sum(axis=1)
+        #rank of zeros in every row
+        R0 = (z + 1) / 2.0 - (npos + 1) / 2.0
+        #sums over positions retained in every pair (rows: i, columns: j)
+        n  = npos - m
+        c  = R0[:, None] + m / 2.0
+        S  = sR[:, None] + m / 2.0 * z[:, None] - m * c
+        Q  = np.diag(RR)[:, None] + m * np.diag(RZ)[:, None] + m**2 / 4.0 * z[:, None] - m * c**2
+        C  = RR + m / 2.0 * (RZ + RZ.T) + m**2 / 4.0 * m - m * c * c.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = (C - S * S.T / n) / np.sqrt((Q - S**2 / n) * (Q.T - S.T**2 / n))
+        rho = np.clip(rho, -1, 1)
+    return rho, spearman_pvalue(rho, n), n
+
+def spearman_pvalue(rho, n):
+    """Return two-sided P-value of Spearman rho from n positions.
+    P-value from t distribution as in scipy.stats.spearmanr.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof  = n - 2
+        t    = rho * np.sqrt(dof / ((rho + 1.0) * (1.0 - rho)))
+        pval = 2 * stats.distributions.t.sf(np.abs(t), dof)
+    return np.where(np.abs(rho) == 1, 0, pval)
+
+def _get_positions(starts, lengths, tids):
+    """Return indices of positions of given transcripts."""
+    tlengths = lengths[tids]
+    return np.repeat(starts[tids] - (np.cumsum(tlengths) - tlengths), tlengths) \
+           + np.arange(tlengths.sum())
+
+def sampled_spearmanr(scores1, scores2, lengths, error=0.01, ignore_zeros=False, \
+                      size=10**5, bootstraps=200, strata=10, seed=0):
+    """Return Spearman rho, P-value, bootstrap 95% confidence interval
+    and number of positions, estimating rho from sample of transcripts.
+
+    Transcripts are sampled in equal fraction from strata of load, starting
+    from about size positions. Confidence interval comes from resampling
+    sampled transcripts with replacement, keeping ranks of the sample,
+    so every bootstrap replicate needs only sums of ranks by transcript.
+    The sample is enlarged until half-width of confidence interval is below error.
+    If all transcripts end up in the sample, exact rho is returned
+    with zero-width interval.
+    """
+    scores1, scores2 = np.asarray(scores1), np.asarray(scores2)
+    lengths = np.asarray(lengths, dtype=int)
+    tids = np.repeat(np.arange(len(lengths)), lengths)
+    if ignore_zeros:
+        nonzero = (scores1 != 0) | (scores2 != 0)
+        scores1, scores2, tids = scores1[nonzero], scores2[nonzero], tids[nonzero]
+        lengths = np.bincount(tids, minlength=len(lengths))
+    npos   = len(scores1)
+    starts = np.cumsum(lengths) - lengths
+    #split transcripts into strata by load
+    loads  = np.bincount(tids, scores1 + scores2, minlength=len(lengths)) / np.maximum(lengths, 1)
+    order  = np.argsort(loads, kind='mergesort')
+    rng    = np.random.RandomState(seed)
+    groups = [rng.permutation(g) for g in np.array_split(order, min(strata, len(order)))]
+    frac   = min(1.0, 1.0 * size / max(npos, 1))
+    while True:
+        sample = np.concatenate([g[:int(np.ceil(frac * len(g)))] for g in groups] or [[]]).astype(int)
+        idx    = _get_positions(starts, lengths, sample)
+        x, y   = stats.rankdata(scores1[idx]), stats.rankdata(scores2[idx])
+        x, y   = x - x.mean(), y - y.mean()
+        rho    = np.corrcoef(x, y)[0, 1] if len(x) > 1 else np.nan
+        if frac == 1:
+            lower = upper = rho
+            break
+        #sums of ranks by sampled transcript
+        stids = np.repeat(np.arange(len(sample)), lengths[sample])
+        sums  = np.array([np.bincount(stids, w, minlength=len(sample)) \
+                          for w in (np.ones(len(x)), x, y, x*x, y*y, x*y)])
+        #resample transcripts
+        rhos = []
+        for i in range(bootstraps):
+            n, sx, sy, sxx, syy, sxy = sums.dot(rng.multinomial(len(sample), [1.0/len(sample)]*len(sample)))
+            rhos.append((sxy - sx*sy/n) / np.sqrt((sxx - sx**2/n) * (syy - sy**2/n)))
+        lower, upper = np.nanpercentile(rhos, [2.5, 97.5])
+        halfwidth = (upper - lower) / 2.0
+        if halfwidth <= error:
+            break
+        #error drops with square root of sample size
+        frac = min(1.0, frac * max(2.0, 1.2 * (halfwidth / error)**2))
+    return rho, float(spearman_pvalue(rho, npos)), lower, upper, npos
+
+def _pairwise_correlation(fnames, lengths, matrix, present, ignore_zeros, verbose, error=0):
+    """Return correlation matrices, comparing every pair of files 
+    over transcripts common to this pair.
+    """
+    scores  = np.zeros((len(fnames), len(fnames)))
+    pvalues = np.zeros((len(fnames), len(fnames)))
+    ci      = np.ones((len(fnames), len(fnames))) if error else None
+    for i in range(len(fnames)):
         #set one for self comparison for scores, pval left 0
         scores[i][i] = 1
-        for j in range(i+1, len(files)):
+        for j in range(i+1, len(fnames)):
             #get fnames
-            fn1, fn2 = files[i].name, files[j].name
+            fn1, fn2 = fnames[i], fnames[j]
             #get common genes
-            cgenes = set(tabdata[fn1].keys()).intersection(tabdata[fn2])
+            common = present[i] & present[j]
+            cgenes = np.count_nonzero(common)
             if cgenes:
                 #get scores
-                scores1, scores2 = concatenate_scores(cgenes, tabdata[fn1], tabdata[fn2], ignore_zeros)
-                #get correlation
-                rho, pval = stats.spearmanr(scores1, scores2) #stats.pearsonr
+                mask = np.repeat(common, lengths)
+                scores1, scores2 = matrix[i, mask], matrix[j, mask]
+                #estimate correlation from sample
+                if error:
+                    rho, pval, lower, upper, npos = sampled_spearmanr(scores1, scores2, lengths[common], \
+                                                                      error, ignore_zeros)
+                    ci[i][j], ci[j][i] = lower, upper
+                else:
+                    if ignore_zeros:
+                        nonzero = (scores1 != 0) | (scores2 != 0)
+                        scores1, scores2 = scores1[nonzero], scores2[nonzero]
+                    #get correlation
+                    rho, pval = stats.spearmanr(scores1, scores2) #stats.pearsonr
+                    npos = len(scores1)
             else:
-                scores1 = []
+                npos = 0
                 rho, pval = 0, 1
             if verbose:
                 info = " %s - %s: %s common positions in %s genes with %.3f %s\n"
-                sys.stderr.write(info%(fn1, fn2, len(scores1), len(cgenes), rho, pval))
+                sys.stderr.write(info%(fn1, fn2, npos, cgenes, rho, pval))
             #store rho and number of common genes
             scores[i][j] = rho
-            scores[j][i] = len(cgenes)
+            scores[j][i] = cgenes
             #store p-value and number of positions
             pvalues[i][j] = pval
-            pvalues[j][i] = len(scores1)
+            pvalues[j][i] = npos
+    return scores, pvalues, ci
+
+def _matrix_correlation(fnames, lengths, matrix, present, ignore_zeros, verbose, error=0):
+    """Return correlation matrices, comparing all files at once
+    over transcripts common to all of them.
+    """
+    scores  = np.zeros((len(fnames), len(fnames)))
+    pvalues = np.zeros((len(fnames), len(fnames)))
+    ci      = np.ones((len(fnames), len(fnames))) if error else None
+    common  = present.all(axis=0)
+    cgenes  = np.count_nonzero(common)
+    if verbose:
+        sys.stderr.write(" %s genes common to all files\n" % cgenes)
+    #estimate correlation of every pair from sample
+    if cgenes and error:
+        rho, pval, n = [np.zeros(scores.shape) for i in range(3)]
+        cmatrix = matrix[:, np.repeat(common, lengths)]
+        for i, j in zip(*np.triu_indices(len(fnames), 1)):
+            rho[i, j], pval[i, j], ci[i, j], ci[j, i], n[i, j] = \
+                sampled_spearmanr(cmatrix[i], cmatrix[j], lengths[common], error, ignore_zeros)
+    elif cgenes:
+        rho, pval, n = spearman_matrix(matrix[:, np.repeat(common, lengths)], ignore_zeros)
+    else:
+        rho, pval, n = np.zeros(scores.shape), np.ones(scores.shape), np.zeros(scores.shape)
+    #rho and p-value above, number of genes and positions below diagonal
+    upper = np.triu_indices(len(fnames), 1)
+    scores[upper]  = rho[upper]
+    scores.T[upper] = cgenes
+    pvalues[upper]  = pval[upper]
+    pvalues.T[upper] = n[upper]
+    np.fill_diagonal(scores, 1)
+    if verbose:
+        info = " %s - %s: %s common positions in %s genes with %.3f %s\n"
+        for i, j in zip(*upper):
+            sys.stderr.write(info%(fnames[i], fnames[j], n[i, j], cgenes, rho[i, j], pval[i, j]))
+    return scores, pvalues, ci
+    
+def tabs2correlation(files, out, load, minCount, controlsFn, ignore_zeros, verbose, threads=1, \
+                     pairwise=False, cache=None, error=0):
+    """Load tab files and report correlation between them.
+    If error, rho is estimated from sample of transcripts with given error target.
+    If cache, results are cached by content of input files and parameters.
+    """
+    fnames = [f.name for f in files]
+    #reuse results for the same files and parameters
+    if cache:
+        key  = get_key("tabs2correlation", CACHEVERSION, fnames + filter(None, [controlsFn]), \
+                       (load, minCount, ignore_zeros, pairwise, error), cache)
+        data = load_results(key, cache)
+        if data:
+            if verbose:
+                sys.stderr.write("Results loaded from cache.\n")
+            report_correlation(out, fnames, data["scores"], data["pvalues"], data.get("ci"))
+            return
+    
+    #load controls
+    controls = []
+    if controlsFn:
+       controls = set(l.strip() for l in open(controlsFn))
+       if verbose:
+           sys.stderr.write(" %s control names loaded.\n" % len(controls))
+           
+    #load tab files
+    if verbose:
+        sys.stderr.write("Loading %s tab files...\n" % len(files))
+    names, offsets, matrix, present = load_tabs(fnames, load, minCount, controls, threads, verbose)
+    lengths = np.diff(offsets)
+
+    #calcute correlation
+    if verbose:
+        sys.stderr.write("Calculating Spearman correlation...\n")        
+    if pairwise:
+        scores, pvalues, ci = _pairwise_correlation(fnames, lengths, matrix, present, ignore_zeros, verbose, error)
+    else:
+        scores, pvalues, ci = _matrix_correlation(fnames, lengths, matrix, present, ignore_zeros, verbose, error)
+    if cache:
+        data = {"scores": scores, "pvalues": pvalues}
+        if ci is not None:
+            data["ci"] = ci
+        save_results(key, data, cache)
+    report_correlation(out, fnames, scores, pvalues, ci)
+
+def report_correlation(out, fnames, scores, pvalues, ci=None):
+    """Save correlation coefficients and P-values"""
     #save header
-    header = "\t".join(f.name for f in files)
+    header = "\t".join(fnames)
     #save array for correlation coefficient
     title = "Spearman correlation coefficient vs number of genes"
     np.savetxt(out, scores,  delimiter="\t", header="%s\n%s"%(title, header), fmt='%.3f')
     # and for P-values
     title = "\nSpearman correlation P-value vs number of compared positions"
     np.savetxt(out, pvalues, delimiter="\t", header="%s\n%s"%(title, header))#, fmt='%.1e')
+    # and for confidence intervals of estimated rho
+    if ci is not None:
+        title = "\nSpearman correlation 95% CI lower vs upper bound"
+        np.savetxt(out, ci, delimiter="\t", header="%s\n%s"%(title, header), fmt='%.3f')
 
 def main():
 
@@ -129,13 +371,22 @@ def main():
                         help="min number of cuts per bp of transcript [%(default)s]")
     parser.add_argument("-m", "--minCount",     default=1, type=int,
                         help="min positions to compare [%(default)s]")
+    parser.add_argument("-t", "--threads",      default=1, type=int,
+                        help="number of files loaded in parallel [%(default)s]")
+    parser.add_argument("-p", "--pairwise",     default=False, action="store_true",
+                        help="compare every pair over its own common transcripts [%(default)s]")
+    parser.add_argument("-e", "--error",        default=0, type=float,
+                        help="estimate rho from sample of transcripts with this error ie. 0.01 [exact]")
+    parser.add_argument("--cache",              nargs="?", const=CACHEDIR, default=None,
+                        help="reuse and store results in cache directory [%s if no directory given]" % CACHEDIR)
   
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
     #process two tabs files
-    tabs2correlation(o.input, o.out, o.load, o.minCount, o.controls, o.ignore_zeros, o.verbose)
+    tabs2correlation(o.input, o.out, o.load, o.minCount, o.controls, o.ignore_zeros, o.verbose, o.threads, \
+                     o.pairwise, o.cache, o.error)
     
 if __name__=='__main__': 
     t0 = datetime.now()
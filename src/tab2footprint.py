@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 desc="""Generate footprints plots from multiple sources.
+
+In batch mode (-G), enrichment profiles of all genes from the list
+are loaded in one pass over every file and Spearman correlation between
+profiles from every pair of files is reported for every gene.
 """
 epilog="""Author:
 l.p.pryszcz@gmail.com
@@ -7,39 +11,113 @@ l.p.pryszcz@gmail.com
 Mizerow, 26/02/2012
 """
 
-import argparse, gzip, os, sys
+import argparse, os, sys
 from datetime import datetime
 import math
 import numpy as np
 from scipy.stats import stats
+from tabreader   import iter_tab
+from groupstats  import group_ranks, group_pearson
 
 import matplotlib.pyplot as plt
 
 def load_tab(handle, gene):
     """Return tab-separated file as list"""
-    #deal with fname instead of fileobj
-    if type(handle) is str:
-        handle = open(handle)
-    #open as gzip if needed
-    if handle.name.endswith('.gz'):
-        handle = gzip.open(handle.name)
+    #deal with fileobj instead of fname
+    if type(handle) is not str:
+        handle = handle.name
     #load
     data = []
-    for l in handle:
-        ldata = l.split('\t')
-        if len(ldata) != 2:
-            info = "Warning: 2 fields expected, but %s found! %s\n"
-            sys.stderr.write(info % (len(ldata), str(ldata)))
-            continue
-        #filter controls
-        geneid = ldata[0]
-        if gene!=geneid:
-            continue
-        #unload tab file
-        cdata = [float(x) for x in ldata[1].strip().strip(';').split(';')]
+    for geneid, cdata in iter_tab(handle, [gene], dtype=float, nfields=2):
+        cdata = np.asarray(cdata, dtype=float)
         #store enrichment
-        data.append([x/np.mean(cdata) for x in cdata])
+        data.append(list(cdata / cdata.mean()))
     return data
+
+def load_counts(fn, genes):
+    """Return dictionary of counts (from first record) for every gene from the list.
+    All genes are read in one pass over the file.
+    """
+    gene2counts = {}
+    if not genes:
+        return gene2counts
+    for geneid, cdata in iter_tab(fn, genes, dtype=float, nfields=2):
+        if geneid not in gene2counts:
+            gene2counts[geneid] = np.asarray(cdata, dtype=float)
+    return gene2counts
+
+def load_enrichment(fnames, genes, verbose):
+    """Return genes present in all files, their lengths and 
+    files x positions matrix of enrichment (counts over mean counts of the gene).
+    """
+    fn2counts = {}
+    for fn in fnames:
+        fn2counts[fn] = load_counts(fn, genes)
+        if verbose:
+            sys.stderr.write(" %s: %s genes\n" % (fn, len(fn2counts[fn])))
+    #genes present in all files with the same length
+    cgenes = []
+    for gene in sorted(set(genes)):
+        lengths = set(len(fn2counts[fn][gene]) for fn in fnames if gene in fn2counts[fn])
+        if len(lengths) != 1 or any(gene not in fn2counts[fn] for fn in fnames):
+            sys.stderr.write("Warning: %s missing or of different length in some files!\n" % gene)
+            continue
+        cgenes.append(gene)
+    lengths = np.array([len(fn2counts[fnames[0]][g]) for g in cgenes], dtype=int)
+    matrix  = np.array([np.concatenate([fn2counts[fn][g] for g in cgenes] or [[]]) for fn in fnames])
+    #normalise by mean of every gene
+    if cgenes:
+        starts = np.cumsum(lengths) - lengths
+        means  = np.add.reduceat(matrix, starts, axis=1) / lengths
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix /= np.repeat(means, lengths, axis=1)
+    return cgenes, lengths, matrix
+
+def plot_footprints(fnames, profiles, outfn):
+    """Save enrichment profiles from every file as separate subplot."""
+    fig, axlist = plt.subplots(len(fnames), 1, sharex='col', squeeze=False)
+    for ax, fn, scores in zip(axlist[:, 0], fnames, profiles):
+        ax.set_title("%s" % os.path.basename(fn).split('.')[0])
+        ax.set_ylabel("Reads enrichment")
+        ax.plot(xrange(1, len(scores)+1), scores)
+    ax.set_xlabel("Position")
+    fig.savefig(outfn, dpi=200)
+    plt.close(fig)
+
+def tab2footprints(files, out, genes, verbose, plotdir=""):
+    """Report Spearman correlation between enrichment profiles
+    from every pair of files for every gene from the list.
+    Save footprint plots for every gene into plotdir, if given.
+    """
+    fnames = [f.name for f in files]
+    if verbose:
+        sys.stderr.write("Loading %s genes from %s files...\n" % (len(set(genes)), len(fnames)))
+    cgenes, lengths, matrix = load_enrichment(fnames, genes, verbose)
+    #rank positions within every gene
+    gids  = np.repeat(np.arange(len(cgenes)), lengths)
+    ranks = [group_ranks(row, gids) for row in matrix]
+    #correlate every pair of files for all genes at once
+    pairs  = [(i, j) for i in range(len(fnames)) for j in range(i+1, len(fnames))]
+    header = ["gene", "length"]
+    results = []
+    for i, j in pairs:
+        pair = "%s-%s" % (fnames[i], fnames[j])
+        header += ["%s rho" % pair, "%s P" % pair]
+        results += group_pearson(ranks[i], ranks[j], gids, len(cgenes))[:2]
+    out.write("#%s\n" % "\t".join(header))
+    fmt = "\t".join(["%.3f", "%.3e"] * len(pairs))
+    for k, gene in enumerate(cgenes):
+        out.write("%s\t%s\t%s\n" % (gene, lengths[k], fmt % tuple(r[k] for r in results)))
+    #save plots
+    if plotdir:
+        if verbose:
+            sys.stderr.write("Plotting %s footprints...\n" % len(cgenes))
+        if not os.path.isdir(plotdir):
+            os.makedirs(plotdir)
+        starts = np.cumsum(lengths) - lengths
+        for k, gene in enumerate(cgenes):
+            profiles = matrix[:, starts[k]:starts[k]+lengths[k]]
+            plot_footprints(fnames, profiles, os.path.join(plotdir, gene+".png"))
     
 def tab2footprint(files, out, gene, verbose):
     """ """
@@ -113,13 +191,25 @@ def main():
                         help="output stream      [stdout]" )
     parser.add_argument("-g", "--gene",         default="TETp9p9.1", 
                         help="report info for gene")
+    parser.add_argument("-G", "--genes",        default="",
+                        help="batch mode: report correlation for genes from file")
+    parser.add_argument("-p", "--plotdir",      default="",
+                        help="batch mode: save footprint plots to directory")
   
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
-    #process two tabs files
-    tab2footprint(o.input, o.out, o.gene, o.verbose)
+    #process many genes
+    if o.genes:
+        out = o.out
+        if type(out) is str:
+            out = open(out, "w")
+        genes = [l.strip() for l in open(o.genes) if l.strip()]
+        tab2footprints(o.input, out, genes, o.verbose, o.plotdir)
+    #or single gene
+    else:
+        tab2footprint(o.input, o.out, o.gene, o.verbose)
     
 if __name__=='__main__': 
     t0 = datetime.now()
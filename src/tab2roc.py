@@ -7,72 +7,97 @@ l.p.pryszcz@gmail.com
 Mizerow, 26/02/2012
 """
 
-import argparse, gzip, os, sys
+import argparse, os, sys
 from datetime import datetime
 import math
 import numpy as np
 from scipy.stats import stats
+from tab2correlation import load_tabs, sampled_spearmanr
+from parscache   import CACHEDIR, get_key, load_results, save_results
 
 from mpl_toolkits.axes_grid1 import host_subplot
 import mpl_toolkits.axisartist as AA
 import matplotlib.pyplot as plt
 
+#names of load sweep results
+SWEEPKEYS = ("rho", "pval", "genes", "positions", "lower", "upper")
+#version of cached load sweeps; increase whenever they change
+SWEEPVERSION = 1
 
-def load_tab(handle, load, minCount, controls):
-    """Return tab-separated file as dict"""
-    #deal with fname instead of fileobj
-    if type(handle) is str:
-        handle = open(handle)
-    #open as gzip if needed
-    if handle.name.endswith('.gz'):
-        handle = gzip.open(handle.name)
-    #load
-    data = {}
-    for l in handle:
-        ldata = l.split('\t')
-        if len(ldata) != 2:
-            info = "Warning: 2 fields expected, but %s found! %s\n"
-            sys.stderr.write(info % (len(ldata), str(ldata)))
-            continue
-        #filter controls
-        geneid = ldata[0]
-        if controls and geneid not in controls:
-            continue
-        #unload tab file
-        cdata = [int(x) for x in ldata[1].strip().strip(';').split(';')]
-        #skip if too small load
-        if load and 1.0 * sum(cdata) / len(cdata) < load:
-            continue
-        #skip if too few cut points
-        if minCount and len(filter(lambda x: x!=0, cdata)) < minCount:
-            continue
-        #store
-        data[geneid] = cdata
-    return data
-
-def concatenate_scores(cgenes, gene2scores1, gene2scores2, ignore_zeros):
-    """Concatenate scores from common genes"""
-    scores1, scores2 = [], []
-    for gene in cgenes:
-        for c1, c2 in zip(gene2scores1[gene], gene2scores2[gene]):
-            if ignore_zeros and not c1 and not c2:
-                continue
-            scores1.append(c1)
-            scores2.append(c2)
-    return scores1, scores2
-
-def load_filter(data, load=0):
-    """Return tabdata filtered by load cut-off"""
-    newdata = {}
-    for gene, scores in data.iteritems():
-        if load and 1.0 * sum(scores) / len(scores) < load:
-            continue
-        newdata[gene] = scores
-    return newdata
+def get_loads(matrix, offsets):
+    """Return load (cuts per bp) of every transcript in every file."""
+    if len(offsets) < 2:
+        return np.zeros((len(matrix), 0))
+    sums = np.add.reduceat(matrix, offsets[:-1], axis=1, dtype=float)
+    return sums / np.diff(offsets)
+
+def load_sweep(scores1, scores2, lengths, loads1, loads2, loads, ignore_zeros, error=0):
+    """Return rho, P-value, number of genes, number of positions
+    and 95% confidence interval of rho for every load cut-off.
+
+    Transcripts are sorted by decreasing min(load1, load2) and their scores
+    are concatenated only once, so transcripts passing given cut-off
+    always form a prefix of concatenated scores.
+    If error, rho is estimated from sample of transcripts with given error target.
+    """
+    minload = np.minimum(loads1, loads2)
+    order   = np.argsort(-minload, kind='mergesort')
+    olengths = lengths[order]
+    #reorder positions by transcripts
+    starts  = np.cumsum(lengths) - lengths
+    idx     = np.repeat(starts[order] - (np.cumsum(olengths) - olengths), olengths) \
+              + np.arange(olengths.sum())
+    scores1, scores2 = scores1[idx], scores2[idx]
+    tids = np.repeat(np.arange(len(order)), olengths)
+    if ignore_zeros:
+        nonzero = (scores1 != 0) | (scores2 != 0)
+        scores1, scores2, tids = scores1[nonzero], scores2[nonzero], tids[nonzero]
+    #number of genes and positions passing every cut-off
+    genes = np.searchsorted(-minload[order], -np.asarray(loads), side='right')
+    positions = np.searchsorted(tids, genes)
+    tlengths  = np.bincount(tids, minlength=len(order))
+    rhos, pvals, lowers, uppers = [], [], [], []
+    pgenes = None
+    for ngenes, npos in zip(genes, positions):
+        #the same genes as for previous cut-off
+        if ngenes == pgenes:
+            pass
+        elif ngenes and error:
+            rho, pval, lower, upper, n = sampled_spearmanr(scores1[:npos], scores2[:npos], \
+                                                           tlengths[:ngenes], error)
+        elif ngenes:
+            rho, pval = stats.spearmanr(scores1[:npos], scores2[:npos])
+            lower = upper = rho
+        else:
+            rho, pval = 0, 1
+            lower = upper = rho
+        pgenes = ngenes
+        rhos.append(rho)
+        pvals.append(pval)
+        lowers.append(lower)
+        uppers.append(upper)
+    return rhos, pvals, genes, positions, lowers, uppers
+    
+def get_sweeps(fnames, controlsFn, loads, ignore_zeros, verbose, threads=1, cache=None, error=0):
+    """Return rho, P-value, number of genes and positions at every load
+    for every pair of files. If cache, results are cached for every pair
+    by content of input files and parameters.
+    """
+    pairs = [(i, j) for i in range(len(fnames)) for j in range(i+1, len(fnames))]
+    pair2key, pair2sweep = {}, {}
+    if cache:
+        params = (ignore_zeros, loads.tolist(), error)
+        for i, j in pairs:
+            key = get_key("load_sweep", SWEEPVERSION, [fnames[i], fnames[j]] + filter(None, [controlsFn]), params, cache)
+            data = load_results(key, cache)
+            if data:
+                pair2sweep[(i, j)] = [data[k] for k in SWEEPKEYS]
+            pair2key[(i, j)] = key
+        if verbose:
+            sys.stderr.write(" %s of %s pairs loaded from cache.\n" % (len(pair2sweep), len(pairs)))
+        if len(pair2sweep) == len(pairs):
+            return pair2sweep
     
-def tabs2correlation(files, out, minload, maxload, stepload, controlsFn, \
-                     ignore_zeros, verbose):
-    """Load tab files and report correlation between them"""
     #load controls
     controls = []
     if controlsFn:
@@ -82,8 +107,35 @@ def tabs2correlation(files, out, minload, maxload, stepload, controlsFn, \
            
     #load tab files
     if verbose:
-        sys.stderr.write("Loading %s tab files...\n" % len(files))
-    tabdata = { f.name: load_tab(f, 0, 0, controls) for f in files }
+        sys.stderr.write("Loading %s tab files...\n" % len(fnames))
+    names, offsets, matrix, present = load_tabs(fnames, 0, 0, controls, threads, verbose)
+    lengths = np.diff(offsets)
+    tabloads = get_loads(matrix, offsets)
+
+    #calcute correlation
+    if verbose:
+        sys.stderr.write("Calculating Spearman correlation...\n")
+    for i, j in pairs:
+        if (i, j) in pair2sweep:
+            continue
+        #get common genes and their scores
+        common = present[i] & present[j]
+        mask   = np.repeat(common, lengths)
+        sweep  = load_sweep(matrix[i, mask], matrix[j, mask], lengths[common], \
+                            tabloads[i, common], tabloads[j, common], loads, ignore_zeros, error)
+        pair2sweep[(i, j)] = sweep
+        if cache:
+            data = dict(zip(SWEEPKEYS, sweep))
+            save_results(pair2key[(i, j)], data, cache)
+    return pair2sweep
+    
+def tabs2correlation(files, out, minload, maxload, stepload, controlsFn, \
+                     ignore_zeros, verbose, threads=1, cache=None, error=0):
+    """Load tab files and report correlation between them"""
+    fnames = [f.name for f in files]
+    #define loads
+    loads = np.arange(minload, maxload, stepload)
+    pair2sweep = get_sweeps(fnames, controlsFn, loads, ignore_zeros, verbose, threads, cache, error)
 
     #start figure
     #http://stackoverflow.com/questions/7733693/matplotlib-overlay-plots-with-different-scales
@@ -93,41 +145,18 @@ def tabs2correlation(files, out, minload, maxload, stepload, controlsFn, \
     #fig, ax = plt.subplots(1, ncombinations, sharey='all')
     fig, ax = plt.subplots(len(files)-1, len(files)-1, sharey='row', sharex='col')
 
-    #define loads
-    loads = np.arange(minload, maxload, stepload)
-    
-    #calcute correlation
-    if verbose:
-        sys.stderr.write("Calculating Spearman correlation...\n")
     axi = 0
     for i in range(len(files)):
         #set one for self comparison for scores, pval left 0
         for j in range(i+1, len(files)):
             #get fnames
-            fn1, fn2 = files[i].name, files[j].name
+            fn1, fn2 = fnames[i], fnames[j]
+            scores, pvals, genes, positions, lowers, uppers = pair2sweep[(i, j)]
             if verbose:
                 sys.stderr.write(" %s - %s\n" % (fn1, fn2))
-            scores, genes = [], []
-            for load in loads:
-                #filter tabdata
-                tabs = [load_filter(tabdata[fn1], load), load_filter(tabdata[fn2], load)]
-                #get common genes
-                cgenes = set(tabs[0].keys()).intersection(tabs[1])
-                if cgenes:
-                    #get scores
-                    scores1, scores2 = concatenate_scores(cgenes, tabs[0], \
-                                                          tabs[1], ignore_zeros)
-                    #get correlation
-                    rho, pval = stats.spearmanr(scores1, scores2) 
-                else:
-                    scores1 = scores2 = []
-                    rho, pval = 0, 1
-                if verbose:
-                    info = " LOAD>=%s: %s common positions in %s genes with %.3f %s\n"
-                    sys.stderr.write(info%(load, len(scores1), len(cgenes), rho, pval))
-                #store rho and number of common genes
-                scores.append(rho)
-                genes.append(len(cgenes))
+                info = " LOAD>=%s: %s common positions in %s genes with %.3f %s\n"
+                for load, npos, ngenes, rho, pval in zip(loads, positions, genes, scores, pvals):
+                    sys.stderr.write(info%(load, npos, ngenes, rho, pval))
 
             #add subplot with two X-axes
             #http://matplotlib.org/examples/axes_grid/demo_parasite_axes2.html
@@ -146,6 +175,8 @@ def tabs2correlation(files, out, minload, maxload, stepload, controlsFn, \
             
             #plot rho and number of genes
             p1, = host.plot(loads, scores, "b", label="Rho")
+            if error:
+                host.fill_between(loads, lowers, uppers, color="b", alpha=0.2)
             p2, = par1.plot(loads, genes,  "r", label="Genes")
             
             #set axes labes
@@ -200,6 +231,12 @@ def main():
                         help="max load [%(default)s]")
     parser.add_argument("--stepLoad",     default= 0.5, type=float,
                         help="load step [%(default)s]")
+    parser.add_argument("-t", "--threads",      default=1, type=int,
+                        help="number of files loaded in parallel [%(default)s]")
+    parser.add_argument("-e", "--error",        default=0, type=float,
+                        help="estimate rho from sample of transcripts with this error ie. 0.01 [exact]")
+    parser.add_argument("--cache",              nargs="?", const=CACHEDIR, default=None,
+                        help="reuse and store results in cache directory [%s if no directory given]" % CACHEDIR)
   
     o = parser.parse_args()
     if o.verbose:
@@ -207,7 +244,7 @@ def main():
 
     #process two tabs files
     tabs2correlation(o.input, o.out, o.minLoad, o.maxLoad, o.stepLoad, o.controls, \
-                     o.ignore_zeros, o.verbose)
+                     o.ignore_zeros, o.verbose, o.threads, o.cache, o.error)
     
 if __name__=='__main__': 
     t0 = datetime.now()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
-desc="""Calculate stats from tab file
+desc="""Calculate stats from tab files:
+0-tail (trailing zeros), 0-head (leading zeros), coverage (fraction
+of positions with cuts) and load (cuts per bp) of transcripts.
 """
 epilog="""Author:
 l.p.pryszcz@gmail.com
@@ -9,36 +11,86 @@ Mizerow, 26/02/2012
 
 import argparse, gzip, os, sys
 from datetime import datetime
+from itertools import imap
+from multiprocessing import Pool
 
 import numpy             as np
 from scipy.stats import stats
 from tab2correlation import load_tab
 
-def get_zero_tail_stats(gene2scores, load=1.0):
-    """Return mean, stdev, min and max 0-tail for given load. """
-    zeros = []
-    for gene, scores in gene2scores.iteritems():
-        #load filter
-        if load and  1.0 * sum(scores) / len(scores) < load:
-            continue
-        #count tailing zeros
-        i, k = -1, 0
-        while not scores[i]:
-            k += 1
-            i -= 1
-        #store count
-        zeros.append(k)
-    return np.mean(zeros), np.std(zeros), min(zeros), max(zeros)
+def get_transcript_stats(counts, offsets):
+    """Return load, leading zeros, trailing zeros and coverage
+    (fraction of positions with cuts) of every transcript.
+    Counts of transcripts are concatenated and start at offsets.
+    """
+    lengths = np.diff(offsets)
+    if not len(lengths):
+        return [np.zeros(0) for i in range(4)]
+    starts  = offsets[:-1]
+    #position within transcript
+    pos     = np.arange(len(counts)) - np.repeat(starts, lengths)
+    nonzero = counts != 0
+    load    = np.add.reduceat(counts, starts, dtype=float) / lengths
+    first   = np.minimum.reduceat(np.where(nonzero, pos, np.repeat(lengths, lengths)), starts)
+    last    = np.maximum.reduceat(np.where(nonzero, pos, -1), starts)
+    coverage = np.add.reduceat(nonzero, starts, dtype=float) / lengths
+    return load, first, lengths - 1 - last, coverage
 
-def tab2stats(tab, out, controls, load, verbose):
-    """Load tab files and report correlation between them"""
-    #load = minCount = 0
-    tabdata = load_tab(tab, 0, 0, controls) 
+def summarise(values):
+    """Return mean, stdev, min and max."""
+    if not len(values):
+        return np.nan, np.nan, np.nan, np.nan
+    return np.mean(values), np.std(values), values.min(), values.max()
 
-    #get length of 0-tail for load=1
-    mean, stdev, minc, maxc = get_zero_tail_stats(tabdata, load)
-    out.write("%s\t%s\t%s\t%s\t%s\n" % (tab.name, mean, stdev, minc, maxc))
-    
+def _get_file_stats(args):
+    """Return stats of library and of every transcript (if transcripts) as text.
+    Executed by worker process.
+    """
+    fn, controls, load, transcripts = args
+    data    = load_tab(fn, 0, 0, controls)
+    names   = sorted(data)
+    lengths = np.array([len(data[n]) for n in names], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+    counts  = np.concatenate([np.asarray(data[n]) for n in names] or [np.zeros(0, dtype=int)])
+    data    = None
+    tload, head, tail, coverage = get_transcript_stats(counts, offsets)
+    tlines  = ""
+    if transcripts:
+        tlines = "".join("%s\t%s\t%s\t%.3f\t%s\t%s\t%.3f\n" % (fn, n, l, tl, h, t, c) \
+                         for n, l, tl, h, t, c in zip(names, lengths, tload, head, tail, coverage))
+    #load filter
+    if load:
+        passed = tload >= load
+        tload, head, tail, coverage = tload[passed], head[passed], tail[passed], coverage[passed]
+    mean, stdev, minc, maxc = summarise(tail)
+    hmean, hstdev = summarise(head)[:2]
+    cmean, cstdev = summarise(coverage)[:2]
+    lmedian = np.median(tload) if len(tload) else np.nan
+    line = "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (fn, mean, stdev, minc, maxc, len(tail), \
+                                                              hmean, hstdev, cmean, cstdev, lmedian)
+    return line, tlines
+
+def tabs2stats(fnames, out, controls, load, verbose, threads=1, transcripts=None):
+    """Report stats of every library (loaded independently, in parallel):
+    number of transcripts, 0-tail, 0-head, coverage and load
+    for transcripts passing load filter.
+    If transcripts, report also stats of every transcript there.
+    """
+    args = [(fn, controls, load, bool(transcripts)) for fn in fnames]
+    if threads > 1:
+        p = Pool(threads)
+        results = p.imap(_get_file_stats, args)
+    else:
+        results = imap(_get_file_stats, args)
+    if transcripts:
+        transcripts.write("#fname\ttranscript\tlength\tload\t0-head\t0-tail\tcoverage\n")
+    for line, tlines in results:
+        out.write(line)
+        if transcripts:
+            transcripts.write(tlines)
+    if threads > 1:
+        p.close()
+        p.join()
 
 def main():
 
@@ -55,6 +107,10 @@ def main():
                         help="min number of cuts per bp of transcript [%(default)s]")
     parser.add_argument("-c", "--controls",     default="", 
                         help="compare only controls loaded from file")
+    parser.add_argument("-t", "--threads",      default=1, type=int,
+                        help="number of files loaded in parallel [%(default)s]")
+    parser.add_argument("-s", "--transcripts",  default="", 
+                        help="report stats of every transcript to file")
   
     o = parser.parse_args()
     if o.verbose:
@@ -63,18 +119,24 @@ def main():
     #load controls
     controls = []
     if o.controls:
-       controls = set(l.strip() for l in open(controlsFn))
+       controls = set(l.strip() for l in open(o.controls))
        if o.verbose:
            sys.stderr.write(" %s control names loaded.\n" % len(controls))
 
+    out = o.out
+    if type(out) is str:
+        out = open(out, "w")
+    transcripts = None
+    if o.transcripts:
+        transcripts = open(o.transcripts, "w")
+
     #process tab files
     if o.verbose:
         sys.stderr.write("Processing %s tab files...\n" % len(o.input))
         
-    header = "fname\tmean\tstdev\tmin\tmax"
-    o.out.write("# 0-tail for LOAD>=%s\n%s\n"%(o.load, header))        
-    for tab in o.input:
-        tab2stats(tab, o.out, controls, o.load, o.verbose)
+    header = "fname\tmean\tstdev\tmin\tmax\ttranscripts\t0-head mean\t0-head stdev\tcoverage mean\tcoverage stdev\tload median"
+    out.write("# 0-tail for LOAD>=%s\n%s\n"%(o.load, header))        
+    tabs2stats([f.name for f in o.input], out, controls, o.load, o.verbose, o.threads, transcripts)
     
 if __name__=='__main__': 
     t0 = datetime.now()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+desc="""Build byte-offset index of .tab/.counts files, so records
+of selected transcripts can be read without scanning whole file.
+
+Index is stored alongside the file (file.tab.idx) and rebuilt
+whenever size or mtime of the file changes. For gzipped files offsets
+refer to uncompressed stream, so seeking still requires decompression
+up to the record, but no parsing of preceding lines. For BGZF files
+(bgzf.py) offsets are virtual, so only block(s) storing the record
+are decompressed.
+
+Index layout:
+- #size<TAB>mtime of indexed file
+- name<TAB>offset<TAB>size for every record
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, gzip, os, sys
+from datetime import datetime
+from bgzf     import BgzfReader, is_bgzf
+
+def _open(fn):
+    """Return file handle, BGZF or gzip if needed."""
+    if is_bgzf(fn):
+        return BgzfReader(fn)
+    if fn.endswith('.gz'):
+        return gzip.open(fn)
+    return open(fn)
+
+def _get_stamp(fn):
+    """Return size and mtime of file as strings."""
+    stat = os.stat(fn)
+    return str(stat.st_size), repr(stat.st_mtime)
+
+def build_index(fn, verbose=0):
+    """Return list of (name, offset, size) for every record of file
+    and store it as fn.idx (if possible).
+    """
+    index  = []
+    handle = _open(fn)
+    offset = handle.tell()
+    for l in iter(handle.readline, ""):
+        name = l.split('\t', 1)[0]
+        if name != l:
+            index.append((name, offset, len(l)))
+        offset = handle.tell()
+    handle.close()
+    #store
+    tmp = "%s.idx.%s" % (fn, os.getpid())
+    try:
+        with open(tmp, "w") as out:
+            out.write("#%s\n" % "\t".join(_get_stamp(fn)))
+            for x in index:
+                out.write("%s\t%s\t%s\n" % x)
+        os.rename(tmp, fn + ".idx")
+    except (IOError, OSError):
+        pass
+    if verbose:
+        sys.stderr.write(" %s records indexed in %s\n" % (len(index), fn))
+    return index
+
+def load_index(fn, verbose=0):
+    """Return dictionary of (offset, size) of records for every name.
+    Index is built if missing or out-of-date.
+    """
+    idxfn = fn + ".idx"
+    index = None
+    if os.path.isfile(idxfn):
+        with open(idxfn) as handle:
+            #skip out-of-date index
+            if handle.readline()[1:-1].split("\t") == list(_get_stamp(fn)):
+                index = []
+                for l in handle:
+                    name, offset, size = l[:-1].split("\t")
+                    index.append((name, int(offset), int(size)))
+    if index is None:
+        index = build_index(fn, verbose)
+    name2records = {}
+    for name, offset, size in index:
+        if name not in name2records:
+            name2records[name] = []
+        name2records[name].append((offset, size))
+    return name2records
+
+def fetch_lines(fn, names, verbose=0):
+    """Yield lines of given transcripts, in the order of file."""
+    name2records = load_index(fn, verbose)
+    records = sorted(r for name in set(names) for r in name2records.get(name, []))
+    handle  = _open(fn)
+    try:
+        for offset, size in records:
+            handle.seek(offset)
+            yield handle.read(size)
+    finally:
+        #close also if generator is abandoned
+        handle.close()
+
+def main():
+
+    usage  = "%(prog)s [options] -i file1.tab [file2.tab ...]"
+    parser  = argparse.ArgumentParser(usage=usage, description=desc, epilog=epilog, \
+                                      formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", "--input",        nargs="+", type=file,
+                        help="input files")
+    parser.add_argument("-g", "--genes",        nargs="*", default=[],
+                        help="report records of genes")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    for f in o.input:
+        if o.genes:
+            for l in fetch_lines(f.name, o.genes, o.verbose):
+                sys.stdout.write(l)
+        else:
+            build_index(f.name, o.verbose)
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+desc="""Shared reader of .tab (name, counts) and .counts (name, length, counts)
+files, plain, gzipped or binary counts store (tab2bin.py).
+
+Semicolon-separated counts are converted into numeric array in one call,
+gzipped files are decompressed by pigz in separate process (if installed),
+and transcripts are filtered (controls, load, minCount) before being returned.
+
+USAGE:
+ tabreader.py -i S1.counts.gz V1.counts.gz
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, gzip, signal, subprocess, sys
+from datetime import datetime
+from distutils.spawn import find_executable
+import numpy as np
+from tab2bin  import is_bin, load_bin
+from tabindex import fetch_lines
+
+#number of pigz decompression threads
+GZTHREADS = 4
+
+def _restore_sigpipe():
+    """Restore default SIGPIPE handler, so child exits quietly
+    once reader closes the pipe.
+    """
+    signal.signal( signal.SIGPIPE,signal.SIG_DFL )
+
+class PipeFile(object):
+    """File-like object reading stdout of decompression command.
+    Process is waited for on close. Error is raised if command failed
+    (ie. corrupted file), unless reading stopped before the end.
+    """
+    def __init__( self,cmd,fn ):
+        self.name = fn
+        self.eof  = False
+        self.proc = subprocess.Popen( cmd,stdout=subprocess.PIPE,bufsize=-1,preexec_fn=_restore_sigpipe )
+
+    def __iter__( self ):
+        for l in self.proc.stdout:
+            yield l
+        self.eof = True
+        self.close()
+
+    def close( self ):
+        if self.proc.returncode is not None:
+            return
+        self.proc.stdout.close()
+        ret = self.proc.wait()
+        if self.eof and ret:
+            raise IOError( "Decompression of %s failed (exit code %s)!" % (self.name,ret) )
+
+def open_file( fn,threads=GZTHREADS ):
+    """Return file handle. Gzipped files are decompressed
+    by pigz in separate process if available.
+    """
+    if not fn.endswith(".gz"):
+        return open( fn )
+    pigz = find_executable( "pigz" )
+    if not pigz or threads<2:
+        return gzip.open( fn )
+    return PipeFile( [ pigz,"-dc","-p",str(threads),fn ],fn )
+
+def parse_counts( field,dtype=float,name="" ):
+    """Return array of semicolon-separated counts.
+    Raise ValueError if any of the counts is not a valid number.
+    """
+    field  = field.strip().strip(";")
+    counts = np.fromstring( field,dtype=dtype,sep=";" )
+    if len( counts ) != field.count(";")+1:
+        raise ValueError( "Cannot parse counts of %s as %s: %s" % (name,np.dtype(dtype).name,field[:100]) )
+    return counts
+
+def _passed( counts,load,minCount ):
+    """Return True if counts pass load and minCount filters."""
+    #skip if too small load
+    if load and 1.0 * counts.sum() / len(counts) < load:
+        return False
+    #skip if too few cut points
+    if minCount and np.count_nonzero( counts ) < minCount:
+        return False
+    return True
+
+def iter_tab( handle,controls=[],load=0,minCount=0,dtype=float,nfields=0,threads=GZTHREADS ):
+    """Yield transcript name and array of counts for every transcript
+    passing filters. Handle can be file name or file object.
+    Counts are read from 2nd column of .tab and 3rd column of .counts files.
+    Lines with other number of fields than nfields (if given) are skipped.
+    If controls, only records of controls are read (using file index).
+    """
+    if controls:
+        controls = set( controls )
+    opened = type( handle ) is str
+    if opened:
+        fn = handle
+        #memory-map binary store
+        if is_bin( fn ):
+            index,data = load_bin( fn )
+            for name,offset,length in index:
+                if controls and name not in controls:
+                    continue
+                counts = data[offset:offset+length]
+                if _passed( counts,load,minCount ):
+                    yield name,counts
+            return
+        #read only records of controls using file index
+        if controls:
+            handle = fetch_lines( fn,controls )
+        else:
+            handle = open_file( fn,threads )
+    try:
+        for l in handle:
+            ldata = l.split('\t')
+            if nfields and len(ldata) != nfields:
+                info = "Warning: %s fields expected, but %s found! %s\n"
+                sys.stderr.write( info % (nfields,len(ldata),str(ldata)) )
+                continue
+            name = ldata[0]
+            if controls and name not in controls:
+                continue
+            counts = parse_counts( ldata[2] if len(ldata)>2 else ldata[1],dtype,name )
+            if _passed( counts,load,minCount ):
+                yield name,counts
+    finally:
+        #close file opened here, also if reading stopped early
+        if opened:
+            handle.close()
+
+def main():
+
+    usage  = "%(prog)s [options] -i file1.tab [file2.tab ...]"
+    parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog, \
+                                       formatter_class=argparse.RawTextHelpFormatter )
+
+    parser.add_argument("-v", "--verbose",      default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", "--input",        nargs="+", type=file,
+                        help="input files")
+    parser.add_argument("-l", "--load",         default=0, type=float,
+                        help="min number of cuts per bp of transcript [%(default)s]")
+    parser.add_argument("-m", "--minCount",     default=0, type=int,
+                        help="min positions with cuts [%(default)s]")
+    parser.add_argument("-t", "--threads",      default=GZTHREADS, type=int,
+                        help="pigz decompression threads [%(default)s]")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    #report number of transcripts, positions and counts passing filters
+    sys.stdout.write( "#fname\ttranscripts\tpositions\tcounts\n" )
+    for f in o.input:
+        i = positions = total = 0
+        for name,counts in iter_tab( f.name,[],o.load,o.minCount,float,0,o.threads ):
+            i         += 1
+            positions += len( counts )
+            total     += counts.sum()
+        sys.stdout.write( "%s\t%s\t%s\t%s\n" % (f.name,i,positions,total) )
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nCtrl-C pressed!      \n")
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )
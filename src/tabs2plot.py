@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 desc="""Plot Pearson corelation between PARS scores from 2 sources.
+
+For every gene, tab-delimited gene name, Pearson r, P-value, number
+of positions, Spearman rho, P-value, slope and intercept of linear fit
+are reported (no header line). Scatter-plots are saved for all genes,
+genes from the list (-g) or none (-n).
 """
 epilog="""Author:
 l.p.pryszcz@gmail.com
@@ -9,10 +14,18 @@ Dublin, 4/07/2012
 
 import argparse, gzip, os, sys
 from datetime import datetime
+from multiprocessing import Pool
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy             as np
 from scipy.stats.stats import pearsonr
 from counts2pars import load_pars
+from groupstats  import group_ranks, group_pearson
+from parscache   import CACHEDIR, get_key, load_results, save_results
+
+#version of cached gene stats; increase whenever they change
+STATSVERSION = 2
 
 def plotData(x,y,color="red",marker="o",name="Data"):
     "From: http://stackoverflow.com/questions/8154511/drawing-a-correlation-graph-in-matplotlib"
@@ -52,47 +65,108 @@ def scatter_plot( outdir,gene,c1,c2,fn1,fn2,color="blue",marker="." ):
     plt.savefig( outfn )
     return pearR,pval
     
-def plot_pars( fn1,fn2,outdir,ignore_zeros,mincount,verbose ):
-    """Calculate log2(v1/s1) for every base from s1/v1.
-    Skip transcripts having load below loadTh in any of the samples.
+def gene_stats( c1,c2,lengths,ignore_zeros,mincount ):
+    """Return Pearson r, P-value, Spearman rho, P-value, slope and intercept
+    of linear fit and number of positions for every gene, as dictionary of arrays.
+    Scores of genes are concatenated in c1 and c2.
     """
+    gids = np.repeat( np.arange( len(lengths) ),lengths )
+    #skip missing data
+    if ignore_zeros:
+        nonzero = ( c1!=0 ) & ( c2!=0 )
+        c1,c2,gids = c1[nonzero],c2[nonzero],gids[nonzero]
+    data = { "positions": np.bincount( gids,minlength=len(lengths) ) }
+    data["coeffs"],data["pvals"],data["slopes"],data["intercepts"] = group_pearson( c1,c2,gids,len(lengths) )
+    x,y = group_ranks( c1,gids ),group_ranks( c2,gids )
+    data["rhos"],data["rpvals"] = group_pearson( x,y,gids,len(lengths) )[:2]
+    #genes with too few positions
+    data["passed"] = data["positions"] >= mincount if ignore_zeros else np.ones( len(lengths),dtype=bool )
+    return data
+
+def report_coeffs( genes,data ):
+    """Report correlation for every gene and summary."""
+    keys = ( "coeffs","pvals","positions","rhos","rpvals","slopes","intercepts" )
+    for i in np.flatnonzero( data["passed"] ):
+        print "%s\t%s" % ( genes[i],"\t".join( str(data[k][i]) for k in keys ) )
+    coeffs = data["coeffs"][ data["passed"] ]
+    sys.stderr.write("Correlation mean: %.2f [+- %.2f] for %s positions\n\n" % ( np.mean(coeffs),np.std(coeffs),data["positions"][ data["passed"] ].sum() ) )
+
+def _scatter_plot( args ):
+    """Save scatter-plot of c1,c2 values. Executed by worker process."""
+    return scatter_plot( *args )
+
+def plot_pars( fn1,fn2,outdir,ignore_zeros,mincount,verbose,cache=None,plotgenes=None,threads=1 ):
+    """Report correlation between PARS scores from two files for every gene
+    and save scatter-plots of plotgenes (all genes if None).
+    If cache, correlations are cached by content of input files and parameters,
+    so files are not loaded again as long as requested plots are present.
+    """
+    #reuse cached correlations if requested plots are present
+    if cache:
+        key  = get_key( "gene_stats",STATSVERSION,[fn1,fn2],( ignore_zeros,mincount ),cache )
+        data = load_results( key,cache )
+        if data:
+            genes = data.pop( "genes" )
+            toplot = [ g for i,g in enumerate( genes ) if data["passed"][i] and \
+                       ( plotgenes is None or g in plotgenes ) ]
+            if all( os.path.isfile( os.path.join( outdir,gene+".png" ) ) for gene in toplot ):
+                if verbose:
+                    sys.stderr.write("Correlations loaded from cache.\n")
+                report_coeffs( genes,data )
+                return
     #first load counts
     if verbose:
         sys.stderr.write("Loading counts...\n")
     counts1 = load_pars( fn1 )
     counts2 = load_pars( fn2 )
 
-    #then process transcripts
-    if verbose:
-        sys.stderr.write("Plotting PARS scores for %s entries...\n" % len(counts2) )
-    i=j=pos=0
-    coeffs = []
+    #get common genes
+    genes = []
     for gene in sorted(counts2.keys()):
-        i+=1
         if gene not in counts1:
             continue
-        if verbose:
-            sys.stderr.write(" %s %s %s    \r" % (i,j,gene) )        
         c1 = counts1[gene]
         c2 = counts2[gene]
         if len(c1)!=len(c2):
             sys.stderr.write("Error: Different transcript length for %s (%s,%s)\n" % (gene,len(c1),len(c2)) )
             continue
-            
-        #skip missing data 
+        genes.append( gene )
+    lengths = np.array( [ len(counts1[g]) for g in genes ],dtype=int )
+    c1 = np.concatenate( [ np.asarray( counts1[g],dtype=float ) for g in genes ] or [[]] )
+    c2 = np.concatenate( [ np.asarray( counts2[g],dtype=float ) for g in genes ] or [[]] )
+
+    #calculate correlation for all genes at once
+    if verbose:
+        sys.stderr.write("Calculating correlation for %s genes...\n" % len(genes) )
+    data = gene_stats( c1,c2,lengths,ignore_zeros,mincount )
+    if cache:
+        save_results( key,dict( data,genes=genes ),cache )
+    report_coeffs( genes,data )
+
+    #save scatterplots
+    toplot = [ i for i in np.flatnonzero( data["passed"] ) if plotgenes is None or genes[i] in plotgenes ]
+    if not toplot:
+        return
+    if verbose:
+        sys.stderr.write("Plotting PARS scores for %s entries...\n" % len(toplot) )
+    starts = np.cumsum( lengths )-lengths
+    args   = []
+    for i in toplot:
+        s1,s2 = c1[starts[i]:starts[i]+lengths[i]],c2[starts[i]:starts[i]+lengths[i]]
         if ignore_zeros:
-            c1,c2 = skip_zeros( c1,c2 )
-            if len(c1)<mincount:
-                continue
-        j += 1
-        #sys.stderr.write("%s\n%.2f\n%.2f\n" % ( gene,"\t".join(str(x) for x in c1),"\t".join(str(x) for x in c2) ) )
-        #save scatterplot and return pearson coefficient and P
-        coeff,p = scatter_plot( outdir,gene,c1,c2,fn1,fn2,color="blue",marker="." )
-        print "%s\t%s\t%s\t%s" % ( gene,coeff,p,len(c1) )
-        coeffs.append( coeff )
-        pos += len(c1)
-        
-    sys.stderr.write("Correlation mean: %.2f [+- %.2f] for %s positions\n\n" % ( np.mean(coeffs),np.std(coeffs),pos ) )
+            s1,s2 = skip_zeros( s1,s2 )
+        args.append( ( outdir,genes[i],s1,s2,fn1,fn2,"blue","." ) )
+    if threads>1:
+        p = Pool( threads )
+        results = p.imap( _scatter_plot,args )
+    else:
+        results = ( _scatter_plot( a ) for a in args )
+    for j,r in enumerate( results,1 ):
+        if verbose:
+            sys.stderr.write(" %s / %s    \r" % (j,len(args)) )
+    if threads>1:
+        p.close()
+        p.join()
        
 def main():
 
@@ -109,6 +183,14 @@ def main():
                         help="ignore zero values [%(default)s]")
     parser.add_argument("-l", dest="mincount",     default=5, type=int,
                         help="min positions to compare [%(default)s]")
+    parser.add_argument("-g", dest="genes",   default="",
+                        help="plot only genes from file")
+    parser.add_argument("-n", dest="noplot",  default=False, action="store_true",
+                        help="report correlation without plotting [%(default)s]")
+    parser.add_argument("-t", dest="threads", default=1, type=int,
+                        help="number of plotting processes [%(default)s]")
+    parser.add_argument("--cache",    nargs="?", const=CACHEDIR, default=None,
+                        help="reuse and store results in cache directory [%s if no directory given]" % CACHEDIR)
   
     o = parser.parse_args()
     if o.verbose:
@@ -117,9 +199,17 @@ def main():
     if not os.path.isdir(o.outdir):
         os.makedirs(o.outdir)
 
+    #genes to plot
+    plotgenes = None
+    if o.noplot:
+        plotgenes = set()
+    elif o.genes:
+        plotgenes = set( l.strip() for l in open(o.genes) )
+
     #process two tabs files
     fn1,fn2 = [ f.name for f in o.files ]
-    plot_pars( fn1,fn2,o.outdir,o.ignore_zeros,o.mincount,o.verbose )
+    plot_pars( fn1,fn2,o.outdir,o.ignore_zeros,o.mincount,o.verbose,o.cache, \
+               plotgenes,o.threads )
     
 if __name__=='__main__': 
     t0 = datetime.now()
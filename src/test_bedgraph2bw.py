@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+"""Tests of bedgraph2bw.py"""
+
+import numpy as np
+import pytest
+from bedgraph2bw import BwWriter, query_bw
+
+def _write( fn,chroms,starts ):
+    writer = BwWriter( fn )
+    writer.add_intervals( chroms,np.array(starts),np.array(starts)+1,np.ones(len(starts)) )
+    writer.close()
+
+def test_query( tmpdir ):
+    fn = str( tmpdir.join( "a.pbw" ) )
+    _write( fn,[ "chrA","chrA","chrB" ],[ 1,5,2 ] )
+    assert query_bw( fn,"chrA",0,10 )["start"].tolist() == [ 1,5 ]
+    assert query_bw( fn,"chrB",0,10,10 )["count"].tolist() == [ 1 ]
+
+@pytest.mark.parametrize( "chroms,starts",[ ([ "chrA","chrB","chrA" ],[ 1,2,3 ]),([ "chrA","chrA" ],[ 5,1 ]) ] )
+def test_unsorted( tmpdir,chroms,starts ):
+    with pytest.raises( ValueError ):
+        _write( str( tmpdir.join( "a.pbw" ) ),chroms,starts )
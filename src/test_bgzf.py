@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Tests of bgzf.py"""
+
+import gzip
+from multiprocessing import Pool
+from bgzf     import BgzfReader, BgzfWriter, is_bgzf
+from tabindex import fetch_lines, load_index
+
+def _lines( n,prefix="t" ):
+    """Return n .counts lines spanning several BGZF blocks."""
+    return [ "%s%05i\t%s\t%s\n" % (prefix,i,i%50+1,";".join( str(x%7) for x in range(i%50+1) ))
+             for i in range(n) ]
+
+def _write( fn,lines,threads=1,pool=None ):
+    out = BgzfWriter( fn,threads,pool=pool )
+    for l in lines:
+        out.write( l )
+    out.close()
+
+def test_roundtrip( tmpdir ):
+    fn    = str( tmpdir.join( "a.counts.gz" ) )
+    lines = _lines( 5000 )
+    _write( fn,lines,threads=2 )
+    assert is_bgzf( fn )
+    #readable as any gzip file
+    assert gzip.open( fn ).read() == "".join( lines )
+    reader = BgzfReader( fn )
+    assert list( reader ) == lines
+    reader.seek( 0 )
+    assert reader.read() == "".join( lines )
+
+def test_index( tmpdir ):
+    fn    = str( tmpdir.join( "a.counts.gz" ) )
+    lines = _lines( 5000 )
+    _write( fn,lines )
+    name2records = load_index( fn )
+    assert len( name2records ) == len( lines )
+    names = [ "t00000","t01234","t04999","t03333" ]
+    assert list( fetch_lines( fn,names ) ) == [ l for l in lines if l.split("\t")[0] in names ]
+    #the same as index built from file
+    index = open( fn+".idx" ).readlines()[1:]
+    tmpdir.join( "a.counts.gz.idx" ).remove()
+    load_index( fn )
+    assert open( fn+".idx" ).readlines()[1:] == index
+
+def test_shared_pool( tmpdir ):
+    pool  = Pool( 2 )
+    fns   = [ str( tmpdir.join( "%s.counts.gz" % i ) ) for i in range(2) ]
+    lines = [ _lines( 3000,"a" ),_lines( 2000,"b" ) ]
+    outs  = [ BgzfWriter( fn,2,pool=pool ) for fn in fns ]
+    for l1,l2 in zip( *lines ):
+        outs[0].write( l1 )
+        outs[1].write( l2 )
+    for l in lines[0][len(lines[1]):]:
+        outs[0].write( l )
+    for out in outs:
+        out.close()
+    pool.close()
+    pool.join()
+    for fn,l in zip( fns,lines ):
+        assert list( BgzfReader( fn ) ) == l
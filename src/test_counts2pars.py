@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Tests of counts2pars.py"""
+
+from math import log
+import numpy as np
+import pytest
+from counts2pars import get_pars, merge_pars
+
+def _save( tmpdir,fn,records ):
+    """Save records as .counts file and return its name."""
+    path = tmpdir.join( fn )
+    path.write( "".join( "%s\t%s\t%s\n" % (name,len(c),";".join(str(x) for x in c))
+                         for name,c in records ) )
+    return str( path )
+
+def test_merge_pars_skips_missing( tmpdir ):
+    fn1 = _save( tmpdir,"s1.counts",[ ("a",[1,2]),("b",[3]),("c",[4,5]) ] )
+    fn2 = _save( tmpdir,"v1.counts",[ ("a",[6,7]),("c",[8,9]),("d",[1]) ] )
+    merged = [ (name,[ list(c) for c in counts ]) for name,counts in merge_pars( fn1,fn2 ) ]
+    assert merged == [ ("a",[ [1,2],[6,7] ]),("c",[ [4,5],[8,9] ]) ]
+
+def test_merge_pars_unsorted( tmpdir ):
+    #the same order, but not sorted by name
+    fn1 = _save( tmpdir,"s1.counts",[ ("c",[1]),("b",[2]),("a",[3]) ] )
+    fn2 = _save( tmpdir,"v1.counts",[ ("c",[1]),("a",[3]) ] )
+    with pytest.raises( ValueError ):
+        list( merge_pars( fn1,fn2 ) )
+
+def _get_pars( s1,v1,minReads,readsPerSample ):
+    """Score positions one by one, as before vectorisation."""
+    pars = []
+    for si,vi in zip( s1,v1 ):
+        if si and vi and si>=readsPerSample and vi>=readsPerSample and si+vi>=minReads:
+            pars.append( "%.2f" % round( log( vi / si,2 ),2 ) )
+        else:
+            pars.append( "0" )
+    return pars
+
+def test_get_pars_rounding():
+    #exact ties (x.xx5), positive and negative, round away from zero
+    k  = np.arange( -41,42,2 )
+    v1 = np.concatenate( ( 2**(k/8.0),2**(-k/8.0) ) )
+    s1 = np.ones( len(v1) )
+    ties = [ x for x in np.log( v1 )/np.log( 2 ) if x*8%2 == 1 ]
+    assert any( "%.2f" % x != "%.2f" % round( x,2 ) for x in ties )
+    assert get_pars( s1,v1,0,0 ) == _get_pars( s1,v1,0,0 )
+    #random counts, some failing read thresholds
+    np.random.seed( 0 )
+    s1 = np.random.randint( 0,20,1000 ).astype( float )
+    v1 = np.random.randint( 0,20,1000 ).astype( float )
+    assert get_pars( s1,v1,10,2 ) == _get_pars( s1,v1,10,2 )
+
+def test_get_pars_zeros_inf():
+    s1 = np.array( [ 0,2,0,np.inf,1 ] )
+    v1 = np.array( [ 2,0,0,1,np.inf ] )
+    with np.errstate( divide='ignore',invalid='ignore' ):
+        assert get_pars( s1,v1,0,0 ) == [ "0","0","0","-inf","inf" ]
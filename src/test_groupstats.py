@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""Tests of groupstats.py"""
+
+import numpy as np
+from scipy.stats import pearsonr, spearmanr
+from groupstats import group_ranks, group_pearson
+
+def test_group_correlation():
+    np.random.seed(0)
+    lengths = [ 10,25,7 ]
+    gids = np.repeat( np.arange( len(lengths) ),lengths )
+    x = np.random.randint( 0,5,len(gids) ).astype( float )
+    y = x + np.random.randint( 0,5,len(gids) )
+    r,pval,slope,intercept = group_pearson( x,y,gids,len(lengths) )
+    rho,rpval = group_pearson( group_ranks( x,gids ),group_ranks( y,gids ),gids,len(lengths) )[:2]
+    for i in range( len(lengths) ):
+        sel = gids==i
+        assert np.allclose( ( r[i],pval[i] ),pearsonr( x[sel],y[sel] ) )
+        assert np.allclose( ( rho[i],rpval[i] ),spearmanr( x[sel],y[sel] ) )
+        assert np.allclose( ( slope[i],intercept[i] ),np.polyfit( x[sel],y[sel],1 ) )
+
+def test_two_positions():
+    #perfect, but meaningless correlation of two points
+    gids = np.array( [ 0,0,1,1,1 ] )
+    x = np.array( [ 1.,2,1,2,3 ] )
+    r,pval = group_pearson( x,2*x,gids,2 )[:2]
+    assert np.allclose( r,1 )
+    assert pval.tolist() == [ 1,0 ]
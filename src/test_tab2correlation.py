@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Tests of tab2correlation.py"""
+
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+from tab2correlation import load_tabs, sampled_spearmanr, spearman_matrix
+
+def _matrix( nfiles=4,npos=500,seed=0 ):
+    """Return files x positions matrix of sparse counts."""
+    np.random.seed( seed )
+    matrix = np.random.poisson( 0.7,(nfiles,npos) )
+    matrix[1] += matrix[0]
+    return matrix
+
+@pytest.mark.parametrize( "ignore_zeros",[ False,True ] )
+def test_spearman_matrix( ignore_zeros ):
+    matrix = _matrix()
+    #small blocks to test blockwise products
+    rho,pval,n = spearman_matrix( matrix,ignore_zeros,blocksize=64 )
+    for i in range( len(matrix) ):
+        for j in range( i+1,len(matrix) ):
+            x,y = matrix[i],matrix[j]
+            if ignore_zeros:
+                sel = ( x!=0 ) | ( y!=0 )
+                x,y = x[sel],y[sel]
+            assert n[i,j] == len(x)
+            assert np.allclose( ( rho[i,j],pval[i,j] ),spearmanr( x,y ) )
+
+def test_sampled_spearmanr_exact():
+    #sample covering all transcripts gives exact rho
+    matrix  = _matrix( 2 )
+    lengths = np.array( [ 100 ]*5 )
+    rho,pval,lower,upper,npos = sampled_spearmanr( matrix[0],matrix[1],lengths,size=10**6 )
+    assert npos == matrix.shape[1]
+    assert np.allclose( ( rho,pval ),spearmanr( matrix[0],matrix[1] ) )
+    assert lower == upper == rho
+
+def test_load_tabs( tmpdir ):
+    fn1,fn2 = tmpdir.join( "a.tab" ),tmpdir.join( "b.tab" )
+    fn1.write( "t2\t1;2\nt1\t3;4;5\n" )
+    #t1 of different length is skipped
+    fn2.write( "t1\t1;1\nt3\t7\n" )
+    names,offsets,matrix,present = load_tabs( [ str(fn1),str(fn2) ],0,0,[] )
+    assert names.tolist() == [ "t1","t2","t3" ]
+    assert offsets.tolist() == [ 0,3,5,6 ]
+    assert matrix.tolist() == [ [ 3,4,5,1,2,0 ],[ 0,0,0,0,0,7 ] ]
+    assert present.tolist() == [ [ True,True,False ],[ False,False,True ] ]
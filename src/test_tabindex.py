@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""Tests of tabindex.py"""
+
+import os
+import pytest
+from bgzf     import BgzfWriter
+from tabindex import fetch_lines
+
+LINES = [ "b\t1;2\n","a\t3\n","c\t4;5;6\n","a\t7\n" ]
+
+def _nfds():
+    """Return number of file descriptors open by this process."""
+    return len( os.listdir( "/proc/self/fd" ) )
+
+@pytest.mark.parametrize( "fn",[ "a.tab","a.tab.gz" ] )
+def test_fetch_lines( tmpdir,fn ):
+    fn = str( tmpdir.join( fn ) )
+    out = BgzfWriter( fn ) if fn.endswith(".gz") else open( fn,"w" )
+    out.write( "".join( LINES ) )
+    out.close()
+    assert list( fetch_lines( fn,[ "c","a" ] ) ) == LINES[1:]
+    #abandoned generator closes the file
+    nfds  = _nfds()
+    lines = fetch_lines( fn,[ "c","a" ] )
+    next( lines )
+    lines.close()
+    assert _nfds() == nfds
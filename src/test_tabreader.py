@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Tests of tabreader.py"""
+
+import gzip
+import pytest
+from tabreader import PipeFile, iter_tab, parse_counts
+
+def test_parse_counts():
+    assert parse_counts( "1;2;3;\n",int ).tolist() == [1,2,3]
+    assert parse_counts( "1.5;0;2",float ).tolist() == [1.5,0,2]
+
+@pytest.mark.parametrize( "field,dtype",[ ("1;2;x;4",float),("1;2.5;3",int),("1;;3",int),("",int) ] )
+def test_parse_counts_malformed( field,dtype ):
+    with pytest.raises( ValueError ) as e:
+        parse_counts( field,dtype,"tr1" )
+    assert "tr1" in str( e.value )
+
+def test_iter_tab_filters( tmpdir ):
+    fn = tmpdir.join( "a.tab" )
+    fn.write( "a\t0;0;1\nb\t2;2;2\nc\t1;0;0;5\n" )
+    records = list( iter_tab( str(fn),load=1,dtype=int ) )
+    assert [ name for name,c in records ] == [ "b","c" ]
+    records = list( iter_tab( str(fn),controls=["a","c"],minCount=2,dtype=int ) )
+    assert [ name for name,c in records ] == [ "c" ]
+
+def _gzip( tmpdir,lines ):
+    fn = str( tmpdir.join( "a.tab.gz" ) )
+    out = gzip.open( fn,"w" )
+    out.write( "".join( lines ) )
+    out.close()
+    return fn
+
+def test_pipefile( tmpdir ):
+    lines = [ "t%s\t1;2;3\n" % i for i in range(10**4) ]
+    fn = _gzip( tmpdir,lines )
+    handle = PipeFile( [ "gzip","-dc",fn ],fn )
+    assert list( handle ) == lines
+    assert handle.proc.returncode == 0
+    #stop reading early
+    handle = PipeFile( [ "gzip","-dc",fn ],fn )
+    next( iter( handle ) )
+    handle.close()
+    assert handle.proc.returncode is not None
+
+def test_pipefile_corrupted( tmpdir ):
+    fn = _gzip( tmpdir,[ "t%s\t1;2;3\n" % i for i in range(10**4) ] )
+    data = open( fn,"rb" ).read()
+    open( fn,"wb" ).write( data[:len(data)//2] )
+    with pytest.raises( IOError ):
+        list( PipeFile( [ "gzip","-dc",fn ],fn ) )
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Tests of transcript2count.py"""
+
+import random
+from StringIO import StringIO
+import pytest
+pysam = pytest.importorskip( "pysam" )
+pytest.importorskip( "genome_annotation" )
+from transcript2count import process_transcripts
+
+REFS = [ ( "chrA",5000 ),( "chrB",4000 ),( "chrC",3000 ) ]
+
+def _save_bam( tmpdir,nreads=2000 ):
+    """Save sorted and indexed BAM with random reads and return its name."""
+    random.seed( 0 )
+    header = { "HD": { "VN": "1.0" },"SQ": [ { "SN": ref,"LN": length } for ref,length in REFS ] }
+    tmp = str( tmpdir.join( "tmp.bam" ) )
+    out = pysam.AlignmentFile( tmp,"wb",header=header )
+    for i in range( nreads ):
+        ri = random.randint( 0,len(REFS)-1 )
+        read = pysam.AlignedSegment()
+        read.query_name      = "r%s" % i
+        read.query_sequence  = "A"*30
+        read.flag            = 16 if random.random()<0.5 else 0
+        read.reference_id    = ri
+        read.reference_start = random.randint( 0,REFS[ri][1]-31 )
+        read.mapping_quality = 30
+        read.cigarstring     = "30M"
+        out.write( read )
+    out.close()
+    bam = str( tmpdir.join( "a.bam" ) )
+    pysam.sort( "-o",bam,tmp )
+    pysam.index( bam )
+    return bam
+
+def _save_bed( tmpdir,n=60 ):
+    """Save BED with transcripts from interleaved chromosomes."""
+    random.seed( 1 )
+    lines = []
+    for i in range( n ):
+        ref,length = REFS[ random.randint( 0,len(REFS)-1 ) ]
+        start = random.randint( 0,length-500 )
+        lines.append( "%s\t%s\t%s\tT%03d\t0\t%s\t0\t0\t0\t2\t50,80\t0,300\n" % \
+                      ( ref,start,start+380,i,random.choice("+-") ) )
+    bed = tmpdir.join( "a.bed" )
+    bed.write( "".join( lines ) )
+    return str( bed )
+
+@pytest.mark.parametrize( "threads,sweep",[ (1,True),(4,False),(4,True) ] )
+def test_bed_order( tmpdir,threads,sweep ):
+    bam,bed = _save_bam( tmpdir ),_save_bed( tmpdir )
+    expected = StringIO()
+    process_transcripts( bed,[ bam ],[ expected ],0,1,False )
+    output = StringIO()
+    process_transcripts( bed,[ bam,bam ],[ output,StringIO() ],0,1,False,threads,5,sweep )
+    assert output.getvalue() == expected.getvalue()
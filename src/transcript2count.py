@@ -13,9 +13,15 @@ versions:
 """
 
 import argparse, os, sys
+import numpy as np
 import pysam
-from datetime import datetime
+from array           import array
+from collections     import deque
+from datetime        import datetime
+from itertools       import izip_longest
+from multiprocessing import Pool
 from genome_annotation import load_transcripts_bed
+from bgzf            import open_output
         
 def get_reads_5ends( samfile,ref,start,end,mapq,reverse ):
     """Return number of reads starting at each position
@@ -45,60 +51,197 @@ def get_reads_5ends( samfile,ref,start,end,mapq,reverse ):
             counts[tpos] += 1
     return counts
 
-def process_transcripts( bed,bam,mapq,offset,verbose ):
+def get_5ends( samfile,ref,mapq ):
+    """Return sorted 5'-end positions of forward and reverse reads
+    from given reference. Every read is decoded only once.
     """
+    fwd,rev = array('l'),array('l')
+    for sam in samfile.fetch( ref ):
+        #skip if low quality
+        if sam.mapq < mapq:
+            continue
+        if sam.is_reverse:
+            if sam.aend is not None:
+                rev.append( sam.aend - 1 )
+        else:
+            fwd.append( sam.pos )
+    ends = []
+    for positions in ( fwd,rev ):
+        if positions:
+            ends.append( np.sort( np.frombuffer( positions,dtype='l' ) ) )
+        else:
+            ends.append( np.zeros( 0,dtype='l' ) )
+    return ends
+
+def get_ends_counts( ends,start,end ):
+    """Return number of reads starting at each position
+    of defined region from sorted 5'-end positions.
     """
-    #first load transcripts
-    if verbose:
-        sys.stderr.write("Loading BED file...\n")
-    transcripts = load_transcripts_bed( bed )#oneoff=True ; print transcripts
+    if end <= start:
+        return []
+    lo,hi = np.searchsorted( ends,[ start,end ] )
+    return np.bincount( ends[lo:hi]-start,minlength=end-start ).tolist()
+
+def get_transcript_counts( samfile,transcript,mapq,offset,ends=None ):
+    """Return number of reads starting at each position
+    of transcript (all exons and UTRs). If 5'-end positions
+    of forward and reverse reads (get_5ends) are provided,
+    counts are taken from them instead of BAM.
+    """
+    ref    = transcript["chromosome"]
+    strand = transcript["strand"]
+    #define strand
+    reverse = False
+    if strand == "-":
+        reverse = True            
+    #process all exons (and UTRs)
+    counts = []
+    exonCount = len(transcript["intervals"])
+    for ii in range(exonCount):
+        #get start and end
+        start,end,score = transcript["intervals"][ii]
+        #add 1bp for transcript start if reverse
+        if ii   == 0 and reverse:
+            start -= offset
+        #add 1bp for transcript end if not reverse
+        if ii+1 == exonCount and not reverse:
+            end   += offset
+        #get counts
+        if ends:
+            counts += get_ends_counts( ends[reverse],start,end )
+        else:
+            counts += get_reads_5ends( samfile,ref,start,end,mapq,reverse )
+    #reverse (or not) and add tailing base count
+    if reverse:
+        counts.reverse()
+    #move all by 1bp - as 1bp added to transcript start)
+    return counts[offset:]
+
+#BAM handles opened by given process
+bam2samfile = {}
+
+def _get_samfile( bam ):
+    """Return BAM handle opened (once) by given process."""
+    if bam not in bam2samfile:
+        bam2samfile[bam] = pysam.Samfile( bam,"rb" )
+    return bam2samfile[bam]
+
+def _init_worker():
+    """Don't reuse BAM handles inherited from parent process."""
+    bam2samfile.clear()
 
-    #then parse bam file for every transcript
+def _count_chunk( args ):
+    """Return BAM index, names and output lines for chunk of transcripts
+    from one chromosome. Executed by worker processes.
+    """
+    bi,bam,chunk,mapq,offset,sweep = args
+    samfile = _get_samfile( bam )
+    #stream all reads from chromosome once
+    ends = None
+    if sweep:
+        ends = get_5ends( samfile,chunk[0][1]["chromosome"],mapq )
+    lines = []
+    for name,transcript in chunk:
+        counts = get_transcript_counts( samfile,transcript,mapq,offset,ends )
+        lines.append( "%s\t%s\t%s\n" % ( name,len(counts),";".join(str(x) for x in counts) ) )
+    return bi,[ name for name,transcript in chunk ],lines
+
+def _report_chunk( outputs,result,ii,verbose ):
+    """Write output lines of chunk into output of its BAM
+    and update number of reported transcripts.
+    """
+    if hasattr( result,"get" ):
+        result = result.get()
+    bi,chunknames,lines = result
+    outputs[bi].write( "".join( lines ) )
+    ii[bi] += len( chunknames )
     if verbose:
-        sys.stderr.write("Parsing BAM file for %s BED entries...\n" % len(transcripts) )
-    #process transcripts
-    i = 0
+        sys.stderr.write(" %s    \r" % " ".join( str(i) for i in ii ) )
+
+def _get_chunks( transcripts,names,chunksize ):
+    """Return chunks of up to chunksize consecutive transcripts.
+    Chunk is also split where chromosome changes.
+    """
+    chunks = []
+    chunk,ref = [],None
+    for name in names:
+        transcript = transcripts[name]
+        if len( chunk ) >= chunksize or transcript["chromosome"] != ref:
+            chunk,ref = [],transcript["chromosome"]
+            chunks.append( chunk )
+        chunk.append( ( name,transcript ) )
+    return chunks
+
+def _get_names( transcripts,bam,verbose ):
+    """Return names of transcripts from refs present in BAM."""
     samfile = pysam.Samfile( bam,"rb" )
     refs    = set( samfile.references )
+    samfile.close()
+    names = []
     for transcript in transcripts:
         #if transcript not in ("YAL001C","YAR002W","YAR002C-A","YAR003W","YAL003W"): continue
-        i += 1
-        if verbose:
-            sys.stderr.write(" %s %s    \r" % (i,transcript) )
-        #ref
-        ref    = transcripts[transcript]["chromosome"]
-        strand = transcripts[transcript]["strand"]
         #check if ref indeed in bam
+        ref = transcripts[transcript]["chromosome"]
         if ref not in refs:
             if verbose:
-                sys.stderr.write( " Warning: %s not in BAM file\n" % ( ref, ) )
+                sys.stderr.write( " Warning: %s not in %s\n" % ( ref,bam ) )
             continue
-        #define strand
-        reverse = False
-        if strand == "-":
-            reverse = True            
-        #process all exons (and UTRs)
-        counts = []
-        exonCount = len(transcripts[transcript]["intervals"])
-        for ii in range(exonCount):
-            #get start and end
-            start,end,score = transcripts[transcript]["intervals"][ii]
-            #add 1bp for transcript start if reverse
-            if ii   == 0 and reverse:
-                start -= offset
-            #add 1bp for transcript end if not reverse
-            if ii+1 == exonCount and not reverse:
-                end   += offset
-            #get counts
-            counts += get_reads_5ends( samfile,ref,start,end,mapq,reverse )
-        #reverse (or not) and add tailing base count
-        if reverse:
-            counts.reverse()
-        #move all by 1bp - as 1bp added to transcript start)
-        counts = counts[offset:]
-        #output line
-        line   = "%s\t%s\t%s\n" % ( transcript,len(counts),";".join(str(x) for x in counts) ) 
-        sys.stdout.write( line )
+        names.append( transcript )
+    return names
+
+def process_transcripts( bed,bams,outputs,mapq,offset,verbose,threads=1,chunksize=100,sweep=False ):
+    """Report 5'-end counts for every transcript from every BAM
+    into corresponding output. Transcript model is loaded once.
+    With threads>1 transcripts are processed by pool of processes
+    (each opens its own BAMs), but reported in the BED order.
+    Chunks from all BAMs are processed concurrently,
+    but only few are kept in memory.
+    With sweep, reads are streamed once for every run of consecutive
+    transcripts from the same chromosome (so only once per chromosome
+    if BED is sorted by chromosome) and counts are sliced from 5'-ends.
+    """
+    #first load transcripts
+    if verbose:
+        sys.stderr.write("Loading BED file...\n")
+    transcripts = load_transcripts_bed( bed )#oneoff=True ; print transcripts
+
+    #then parse bam files for every transcript
+    if verbose:
+        sys.stderr.write("Parsing %s BAM file(s) for %s BED entries...\n" % (len(bams),len(transcripts)) )
+    #skip transcripts from refs absent in bam
+    bamnames = [ _get_names( transcripts,bam,verbose ) for bam in bams ]
+    #process transcripts
+    if threads<2 and not sweep:
+        for bam,names,output in zip( bams,bamnames,outputs ):
+            samfile = _get_samfile( bam )
+            for i,transcript in enumerate( names,1 ):
+                if verbose:
+                    sys.stderr.write(" %s %s %s    \r" % (bam,i,transcript) )
+                counts = get_transcript_counts( samfile,transcripts[transcript],mapq,offset )
+                #output line
+                line   = "%s\t%s\t%s\n" % ( transcript,len(counts),";".join(str(x) for x in counts) ) 
+                output.write( line )
+        return
+    #or process chromosome chunks (in parallel)
+    bamargs = []
+    for bi,( bam,names ) in enumerate( zip( bams,bamnames ) ):
+        size = len( names ) if sweep else chunksize
+        bamargs.append( [ ( bi,bam,chunk,mapq,offset,sweep ) for chunk in _get_chunks( transcripts,names,size ) ] )
+    #interleave chunks from different BAMs, keeping BED order within every BAM
+    args = [ arg for group in izip_longest( *bamargs ) for arg in group if arg ]
+    pool = Pool( threads,_init_worker ) if threads>1 else None
+    #and report in submission order, keeping at most 2*threads chunks in memory
+    ii = [ 0 for bam in bams ]
+    pending = deque()
+    for arg in args:
+        pending.append( pool.apply_async( _count_chunk,( arg, ) ) if pool else _count_chunk( arg ) )
+        while len( pending )>2*threads:
+            _report_chunk( outputs,pending.popleft(),ii,verbose )
+    while pending:
+        _report_chunk( outputs,pending.popleft(),ii,verbose )
+    if pool:
+        pool.close()
+        pool.join()
 
 def main():
 
@@ -107,21 +250,47 @@ def main():
     
     parser.add_argument("-v", dest="verbose", default=False, action="store_true", help="verbose")    
     parser.add_argument('--version', action='version', version='0.2')
-    parser.add_argument("-a", dest="bam",  type=file,
-                        help="bam file (sorted)     [%(default)s]")
+    parser.add_argument("-a", dest="bams", nargs="+", type=file,
+                        help="bam file(s) (sorted)  [%(default)s]")
     parser.add_argument("-b", dest="bed",  type=file,
                         help="bed file              [%(default)s]")
+    parser.add_argument("-o", dest="outputs", nargs="+", default=[],
+                        help="output file for every bam; BGZF with transcript index if ends with .gz [stdout or BAM.counts if several bams]")
     parser.add_argument("-q", dest="mapq", default=0, type=int,
                         help="min mapping quality   [%(default)s]")
-    parser.add_argument('--offset', dest='offset', default=1,
+    parser.add_argument('--offset', dest='offset', default=1, type=int,
                         help="reads are counted for base upstream [%(default)s]")
+    parser.add_argument("-t", dest="threads", default=1, type=int,
+                        help="number of processes to use [%(default)s]")
+    parser.add_argument("--sweep", dest="sweep", default=False, action="store_true",
+                        help="stream reads of every chromosome only once [%(default)s]")
   
     o = parser.parse_args()
     if o.verbose:
         sys.stderr.write( "Options: %s\n" % str(o) )
 
+    #define outputs
+    bams = [ f.name for f in o.bams ]
+    pool = None
+    if o.outputs:
+        if len( o.outputs ) != len( bams ):
+            parser.error( "Provide one output for every BAM file!" )
+        #one compression pool shared by all BGZF outputs
+        if o.threads>1 and any( fn.endswith(".gz") for fn in o.outputs ):
+            pool = Pool( o.threads )
+        outputs = [ open_output( fn,o.threads,pool ) for fn in o.outputs ]
+    elif len( bams ) == 1:
+        outputs = [ sys.stdout ]
+    else:
+        outputs = [ open( bam+".counts","w" ) for bam in bams ]
+
     #process all transcripts
-    process_transcripts( o.bed.name,o.bam.name,o.mapq,o.offset,o.verbose )
+    process_transcripts( o.bed.name,bams,outputs,o.mapq,o.offset,o.verbose,o.threads,sweep=o.sweep )
+    for output in outputs:
+        output.close()
+    if pool:
+        pool.close()
+        pool.join()
         
 if __name__=='__main__': 
     t0 = datetime.now()
@@ -1,29 +1,137 @@
 #!/usr/bin/env python
-"""Transpose tab and semi-colon separated data"""
-
-import sys
-
-outcols=[]
-maxlen=0
-for l in sys.stdin:
-  outcols.append([])
-  #split by tab
-  for row in l.split('\t'):
-    #split by semicolon
-    for r in row.split(';'):
-      outcols[-1].append(r)
-      #print r
-
-  if len(outcols[-1])>maxlen:
-    maxlen=len(outcols[-1])
-    
-lines=[ [] for x in range(maxlen) ]    
-for i in range(maxlen):
-  for j in range(len(outcols)):
-    cell=""
-    if i < len(outcols[j]):
-      cell=outcols[j][i]
-    lines[i].append( cell ) 
-    
-for l in lines:
-  print "\t".join(l)
+desc="""Transpose tab and semi-colon separated data.
+
+Rows are split by tab and semi-colon into cells. Shorter rows are
+padded with empty cells. Blocks of rows are transposed in memory
+and stored in temporary files, which are then pasted side by side,
+so memory usage is bounded by block size, not by input size.
+
+USAGE:
+ transpose.py < S1.counts > S1.counts.transposed
+"""
+epilog="""Author:
+l.p.pryszcz@gmail.com
+
+Barcelona, 18/10/2026
+"""
+
+import argparse, os, sys, tempfile
+from datetime import datetime
+from itertools import izip
+
+#number of cells transposed in memory
+CHUNKSIZE = 10**7
+#max number of blocks pasted at once
+MAXOPEN   = 256
+
+def _split( line ):
+    """Return cells of tab and semi-colon separated line."""
+    if line.endswith("\n"):
+        line = line[:-1]
+    return [ r for row in line.split('\t') for r in row.split(';') ]
+
+def _write_block( rows,out ):
+    """Write transposed rows. Return number of lines."""
+    maxlen = max( len(r) for r in rows )
+    for i in xrange( maxlen ):
+        out.write( "\t".join( r[i] if i < len(r) else "" for r in rows ) + "\n" )
+    return maxlen
+
+def _dump_block( rows,tmpdir ):
+    """Save transposed rows into temporary file.
+    Return file name, number of rows and number of lines.
+    """
+    fd,fn = tempfile.mkstemp( prefix="transpose.",dir=tmpdir )
+    out = os.fdopen( fd,"w" )
+    nlines = _write_block( rows,out )
+    out.close()
+    return fn,len(rows),nlines
+
+def _iter_block( block,nlines ):
+    """Yield lines of block, padded with empty lines up to nlines."""
+    fn,nrows,maxlen = block
+    for l in open( fn ):
+        yield l[:-1]
+    empty = "\t" * (nrows-1)
+    for i in xrange( maxlen,nlines ):
+        yield empty
+
+def _paste_blocks( blocks,out ):
+    """Write lines of blocks side by side. Return number of lines."""
+    nlines = max( b[2] for b in blocks )
+    for cells in izip( *[ _iter_block( b,nlines ) for b in blocks ] ):
+        out.write( "\t".join( cells ) + "\n" )
+    return nlines
+
+def transpose( handle,out,chunksize=CHUNKSIZE,tmpdir=None,verbose=0 ):
+    """Transpose tab and semi-colon separated data.
+    At most chunksize cells are kept in memory.
+    """
+    blocks,fnames = [],[]
+    rows,ncells = [],0
+    try:
+        for l in handle:
+            rows.append( _split( l ) )
+            ncells += len( rows[-1] )
+            if ncells >= chunksize:
+                blocks.append( _dump_block( rows,tmpdir ) )
+                fnames.append( blocks[-1][0] )
+                rows,ncells = [],0
+        #everything fits in memory
+        if not blocks:
+            if rows:
+                _write_block( rows,out )
+            return
+        if rows:
+            blocks.append( _dump_block( rows,tmpdir ) )
+            fnames.append( blocks[-1][0] )
+            rows = []
+        if verbose:
+            sys.stderr.write( " %s blocks of %s rows stored\n" % (len(blocks),sum( b[1] for b in blocks )) )
+        #paste groups of blocks, if too many to open at once
+        while len( blocks ) > MAXOPEN:
+            merged = []
+            for i in range( 0,len(blocks),MAXOPEN ):
+                group  = blocks[i:i+MAXOPEN]
+                fd,fn  = tempfile.mkstemp( prefix="transpose.",dir=tmpdir )
+                fnames.append( fn )
+                output = os.fdopen( fd,"w" )
+                nlines = _paste_blocks( group,output )
+                output.close()
+                merged.append( ( fn,sum( b[1] for b in group ),nlines ) )
+                for b in group:
+                    os.unlink( b[0] )
+            blocks = merged
+        _paste_blocks( blocks,out )
+    finally:
+        for fn in fnames:
+            if os.path.isfile( fn ):
+                os.unlink( fn )
+
+def main():
+    usage  = "%(prog)s [options] < in.tab > out.tab"
+    parser  = argparse.ArgumentParser( usage=usage,description=desc,epilog=epilog, \
+                                       formatter_class=argparse.RawTextHelpFormatter )
+
+    parser.add_argument("-v", dest="verbose", default=False, action="store_true", help="verbose")
+    parser.add_argument('--version', action='version', version='1.0')
+    parser.add_argument("-i", dest="input",   default=sys.stdin,  type=file,
+                        help="input              [stdin]")
+    parser.add_argument("-o", dest="output",  default=sys.stdout, type=argparse.FileType('w'),
+                        help="output             [stdout]")
+    parser.add_argument("-m", "--chunksize", default=CHUNKSIZE, type=int,
+                        help="max cells transposed in memory [%(default)s]")
+    parser.add_argument("-T", "--tmpdir", default=None,
+                        help="directory for temporary files [system default]")
+
+    o = parser.parse_args()
+    if o.verbose:
+        sys.stderr.write( "Options: %s\n" % str(o) )
+
+    transpose( o.input,o.output,o.chunksize,o.tmpdir,o.verbose )
+
+if __name__=='__main__':
+    t0 = datetime.now()
+    main()
+    dt = datetime.now()-t0
+    sys.stderr.write( "#Time elapsed: %s\n" % dt )